@@ -0,0 +1,151 @@
+"""All-vs-all best-offset alignment of every sequence in a fasta directory.
+
+    python3 align_all.py ../data/fasta/ [-o pairs.tsv] [-j 8] [-m fft]
+
+Every record of every *.fasta / *.fa / *.fna file in the directory is
+aligned against every other with align_seqs.best_offset(). The work is
+spread over a process pool; the sequences are copied once into a block of
+shared memory that the workers attach to, so only pairs of integer indices
+are pickled per task. Results are streamed as a TSV with the columns
+
+    id1  id2  best_offset  best_score
+
+where id1 is the longer sequence and best_offset is the start of id2 on it.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import align_seqs
+from fasta_reader import FastaFile
+from runtools import add_jobs_argument, ordered_results
+
+FASTA_SUFFIXES = (".fasta", ".fa", ".fna")
+
+# Pairs handed to a worker per task, and tasks kept in flight per worker
+PAIRS_PER_TASK = 64
+TASKS_PER_WORKER = 4
+
+# Set in each worker by _attach()
+_shm = None
+_bases = None
+_starts = None
+
+
+def fasta_files(directory):
+    """ Returns the sorted fasta file paths in directory """
+    return sorted(os.path.join(directory, fn) for fn in os.listdir(directory)
+                  if fn.endswith(FASTA_SUFFIXES))
+
+
+def load_shared(filenames):
+    """ Returns (shm, ids, starts): every record of the fasta files copied
+    into one SharedMemory block, the record names, and an int64 array of
+    record boundaries (record i is bases[starts[i]:starts[i + 1]]) """
+    ids = []
+    lengths = []
+    for fn in filenames:
+        with FastaFile(fn) as fa:
+            for rec in fa:
+                ids.append(rec.name)
+                lengths.append(len(rec))
+    starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+
+    shm = shared_memory.SharedMemory(create=True, size=max(int(starts[-1]), 1))
+    bases = np.ndarray(int(starts[-1]), dtype=np.uint8, buffer=shm.buf)
+    i = 0
+    for fn in filenames:
+        with FastaFile(fn) as fa:
+            for rec in fa:
+                bases[starts[i]:starts[i + 1]] = rec.seq()
+                i += 1
+    del bases # release the exported buffer so shm can be closed
+    return shm, ids, starts
+
+
+def _attach(shm_name, starts):
+    """ Pool initializer: maps the shared sequence block into the worker """
+    global _shm, _bases, _starts
+    # workers share the parent's resource tracker, so attaching here does
+    # not make a worker unlink the block when it exits; the parent does that
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _starts = starts
+    _bases = np.ndarray(int(starts[-1]), dtype=np.uint8, buffer=_shm.buf)
+
+
+def _align_pairs(pairs, method):
+    """ Returns [(i, j, offset, score)] for a batch of index pairs, with i
+    the longer sequence """
+    out = []
+    for i, j in pairs:
+        s_i = _bases[_starts[i]:_starts[i + 1]]
+        s_j = _bases[_starts[j]:_starts[j + 1]]
+        if len(s_i) < len(s_j):
+            i, j, s_i, s_j = j, i, s_j, s_i
+        offset, score, _ = align_seqs.best_offset(s_i, s_j, method=method)
+        out.append((i, j, offset, score))
+    return out
+
+
+def _pair_batches(n):
+    """ Yields lists of at most PAIRS_PER_TASK index pairs (i < j) """
+    batch = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            batch.append((i, j))
+            if len(batch) == PAIRS_PER_TASK:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def align_all(filenames, method="direct", workers=None):
+    """ Yields (id1, id2, best_offset, best_score) for every pair of records
+    in the fasta files, in pair order """
+    shm, ids, starts = load_shared(filenames)
+    workers = workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(shm.name, starts)) as pool:
+            tasks = ((batch, method) for batch in _pair_batches(len(ids)))
+            for _, rows in ordered_results(pool, _align_pairs, tasks,
+                                           workers * TASKS_PER_WORKER):
+                for i, j, offset, score in rows:
+                    yield ids[i], ids[j], offset, score
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directory of fasta files")
+    parser.add_argument("-o", "--output", help="TSV file (default: stdout)")
+    add_jobs_argument(parser)
+    parser.add_argument("-m", "--method", default="direct",
+                        choices=("direct", "fft", "packed"),
+                        help="align_seqs.best_offset() scoring mode")
+    args = parser.parse_args(argv[1:])
+
+    filenames = fasta_files(args.directory)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        out.write("id1\tid2\tbest_offset\tbest_score\n")
+        for row in align_all(filenames, args.method, args.jobs):
+            out.write("%s\t%s\t%d\t%d\n" % row)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -1,56 +1,316 @@
+"""Align two DNA sequences by sliding the shorter one along the longer one.
+
+The score of an alignment is the number of matching bases. Scores for every
+start offset are computed in one batched NumPy pass over uint8-encoded
+sequences; printing an alignment is left to render_alignment(), so the
+scoring engine stays fast on kilobase to megabase sequences.
+
+For genome-scale inputs score_all_offsets_fft() gets the same scores from
+one FFT cross-correlation per base in O((l1 + l2) log(l1 + l2)), and the
+"packed" mode scores 32 bases per 64-bit word operation (see packed_seq.py).
+score_both_strands() also scores the reverse complement of the shorter
+sequence in the same pass, for reads that may come from either strand.
+
+align() is the quiet library entry point: it prints nothing and returns an
+AlignmentResult, whose text rendering is only built when asked for.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from packed_seq import BASE_CODES, COMPLEMENT, PackedSeq
+
 # Two example sequences to match
 seq2 = "ATCGCCGGATTACGGG"
 seq1 = "CAATTCGGAT"
 
-# Assign the longer sequence s1, and the shorter to s2
-# l1 is length of the longest, l2 that of the shortest
+# Upper bound on the number of base comparisons held in memory at once
+BLOCK_CELLS = 2 ** 24
+
+# Bases that can match in the FFT mode; anything else (e.g. N) is a mismatch
+FFT_ALPHABET = b"ACGT"
+
+
+def encode(seq):
+    """ Returns seq (str, bytes or uint8 array) as a uint8 NumPy array """
+    if isinstance(seq, np.ndarray):
+        return seq.astype(np.uint8, copy=False)
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    return np.frombuffer(seq, dtype=np.uint8)
+
+
+def order_by_length(seq1, seq2):
+    """ Returns (s1, s2, l1, l2) with s1 the longer sequence and l1 its length """
+    l1 = len(seq1)
+    l2 = len(seq2)
+    if l1 >= l2:
+        return seq1, seq2, l1, l2
+    return seq2, seq1, l2, l1
+
+
+def reverse_complement(seq):
+    """ Returns the reverse complement of seq, as a str for str input and a
+    uint8 array otherwise """
+    rc = bytes(encode(seq)[::-1]).translate(COMPLEMENT)
+    if isinstance(seq, str):
+        return rc.decode('ascii')
+    return np.frombuffer(rc, dtype=np.uint8)
+
+
+def _score_windows(a1, queries, block_cells):
+    """ Returns a (len(queries), len(a1)) int64 array of the matches of each
+    row of queries placed at every offset of a1, in one pass over a1 """
+    k, l2 = queries.shape
+    l1 = len(a1)
+    scores = np.zeros((k, l1), dtype=np.int64)
+    if l1 == 0 or l2 == 0:
+        return scores
+
+    # pad s1 with zero bytes, which never match a base, so that every offset
+    # sees a full window of length l2
+    padded = np.zeros(l1 + l2, dtype=np.uint8)
+    padded[:l1] = a1
+    windows = sliding_window_view(padded, l2)[:l1] # zero-copy (l1, l2) view
+
+    step = max(1, block_cells // (l2 * k))
+    for start in range(0, l1, step):
+        block = windows[start:start + step, None, :] # each window vs all rows
+        scores[:, start:start + step] = np.count_nonzero(
+            block == queries, axis=2).T
+    return scores
+
+
+def score_all_offsets(s1, s2, block_cells=BLOCK_CELLS):
+    """ Returns an int64 array holding the number of matches of s2 placed at
+    every start offset 0 .. len(s1) - 1 of s1.
+
+    Positions of s2 hanging off the end of s1 score nothing, exactly as in
+    calculate_score().
+    """
+    return _score_windows(encode(s1), encode(s2)[None, :], block_cells)[0]
+
+
+def _fft_scores(a1, a2, alphabet, both_strands):
+    """ Returns the FFT scores of a2 (and, if both_strands, of its reverse
+    complement) at every offset of a1, as a (1 or 2, len(a1)) array """
+    l1, l2 = len(a1), len(a2)
+    rows = 2 if both_strands else 1
+    if l1 == 0 or l2 == 0:
+        return np.zeros((rows, l1), dtype=np.int64)
+
+    # a transform length of at least l1 + l2 - 1 keeps the circular
+    # correlation from wrapping onto the offsets we read back
+    m = l1 + l2 - 1
+    n = 1 << (m - 1).bit_length() # next power of two >= m
+    spectra = {base: np.fft.rfft((a2 == base).astype(np.float64), n)
+               for base in alphabet}
+    # the reverse complement needs no transforms of its own: reversing a
+    # real signal of length l2 conjugates its spectrum up to a phase ramp
+    ramp = np.exp(-2j * np.pi * np.arange(n // 2 + 1) * (l2 - 1) / n)
+    out = np.zeros((rows, n // 2 + 1), dtype=np.complex128)
+    for base in alphabet:
+        s1_spectrum = np.fft.rfft((a1 == base).astype(np.float64), n)
+        out[0] += s1_spectrum * np.conj(spectra[base])
+        if both_strands:
+            partner = bytes([base]).translate(COMPLEMENT)[0]
+            rc_spectrum = ramp * np.conj(spectra[partner])
+            out[1] += s1_spectrum * np.conj(rc_spectrum)
+    counts = np.fft.irfft(out, n, axis=1)[:, :l1]
+    return np.rint(counts).astype(np.int64)
+
+
+def score_all_offsets_fft(s1, s2, alphabet=FFT_ALPHABET):
+    """ Returns the same scores as score_all_offsets(), computed by FFT
+    cross-correlation of one-hot encoded sequences.
+
+    Only bases in alphabet can match, so an N (or any other symbol) always
+    scores as a mismatch; for sequences written in alphabet the result is
+    identical to score_all_offsets().
+    """
+    return _fft_scores(encode(s1), encode(s2), alphabet, False)[0]
+
+
+def score_both_strands(s1, s2, method="direct"):
+    """ Returns a (2, len(s1)) int64 array: the scores of s2 (row 0) and of
+    its reverse complement (row 1) at every offset of s1.
+
+    The direct mode compares each window of s1 with both strands in the
+    same pass; the FFT mode transforms s1 once and derives the reverse
+    strand's spectrum from the forward one.
+    """
+    a1 = encode(s1)
+    a2 = encode(s2)
+    if method == "direct":
+        return _score_windows(a1, np.stack((a2, reverse_complement(a2))),
+                              BLOCK_CELLS)
+    if method == "fft":
+        return _fft_scores(a1, a2, FFT_ALPHABET, True)
+    if method == "packed":
+        p1, p2 = PackedSeq.pack(a1), PackedSeq.pack(a2)
+        return np.stack((p1.score_offsets(p2),
+                         p1.score_offsets(p2.reverse_complement())))
+    raise ValueError("unknown method %r" % (method,))
+
+
+def best_offset(s1, s2, method="direct"):
+    """ Returns (offset, score, scores) for the best placement of s2 on s1.
+
+    method is "direct" (score_all_offsets), "fft" (score_all_offsets_fft)
+    or "packed" (PackedSeq.score_offsets); the last two never match an N.
+    Ties go to the smallest offset.
+    """
+    if method == "direct":
+        scores = score_all_offsets(s1, s2)
+    elif method == "fft":
+        scores = score_all_offsets_fft(s1, s2)
+    elif method == "packed":
+        scores = PackedSeq.pack(encode(s1)).score_offsets(
+            PackedSeq.pack(encode(s2)))
+    else:
+        raise ValueError("unknown method %r" % (method,))
+    if len(scores) == 0:
+        return 0, 0, scores
+    offset = int(np.argmax(scores))
+    return offset, int(scores[offset]), scores
+
+
+class AlignmentResult:
+    """ The placement of s2 at offset on s1: its score and a bit array of
+    which overlapping positions match (packed with np.packbits). strand is
+    "-" when s2 is the reverse complement of the query. """
+
+    __slots__ = ("offset", "score", "mask", "length", "s1", "s2", "strand")
+
+    def __init__(self, s1, s2, offset, score, mask, length, strand="+"):
+        self.s1 = s1
+        self.s2 = s2
+        self.offset = offset
+        self.score = score
+        self.mask = mask
+        self.length = length
+        self.strand = strand
+
+    def __repr__(self):
+        return "AlignmentResult(offset=%d, score=%d, strand=%r)" % (
+            self.offset, self.score, self.strand)
+
+    def matches(self):
+        """ Returns a boolean array, True where the overlapping bases match """
+        return np.unpackbits(self.mask, count=self.length).astype(bool)
+
+    def render(self):
+        """ Returns the text rendering of render_alignment() """
+        matched = np.where(self.matches(), ord('*'), ord('-'))
+        return "\n".join(["." * self.offset
+                          + matched.astype(np.uint8).tobytes().decode(),
+                          "." * self.offset + _as_str(self.s2),
+                          _as_str(self.s1)])
+
+
+def _matching(a1, a2, method):
+    """ Returns a boolean array, True where the bases of a1 and a2 match
+    under the rules of a scoring method: any equal bytes for "direct",
+    A, C, G and T only for "fft", and A, C, G and T in either case for
+    "packed" """
+    if method == "direct":
+        return a1 == a2
+    if method == "fft":
+        return (a1 == a2) & np.isin(a1, np.frombuffer(FFT_ALPHABET, np.uint8))
+    if method == "packed":
+        c1 = BASE_CODES[a1]
+        return (c1 == BASE_CODES[a2]) & (c1 != 255)
+    raise ValueError("unknown method %r" % (method,))
+
+
+def align_at(s1, s2, offset, strand="+", method="direct"):
+    """ Returns the AlignmentResult of s2 placed at offset on s1, with the
+    matches counted as the scoring method counts them """
+    a1 = encode(s1)
+    a2 = encode(s2)
+    n = max(0, min(len(a2), len(a1) - offset))
+    eq = _matching(a1[offset:offset + n], a2[:n], method)
+    return AlignmentResult(s1, s2, offset, int(np.count_nonzero(eq)),
+                           np.packbits(eq), n, strand)
+
+
+def align(seq1, seq2, method="direct"):
+    """ Returns the AlignmentResult for the best placement of the shorter
+    sequence on the longer one, without printing anything. The score and
+    match mask follow the rules of method, so they agree with best_offset():
+
+    >>> align("acgtTTTTacgt", "ACGT")
+    AlignmentResult(offset=1, score=1, strand='+')
+    >>> align("acgtTTTTacgt", "ACGT", "packed")
+    AlignmentResult(offset=0, score=4, strand='+')
+    >>> align("NNNNACGTAC", "NNNN")
+    AlignmentResult(offset=0, score=4, strand='+')
+    >>> align("NNNNACGTAC", "NNNN", "fft")
+    AlignmentResult(offset=0, score=0, strand='+')
+    """
+    s1, s2, l1, l2 = order_by_length(seq1, seq2)
+    offset = best_offset(s1, s2, method)[0]
+    return align_at(s1, s2, offset, method=method)
+
+
+def align_both_strands(seq1, seq2, method="direct"):
+    """ Returns (forward, reverse) AlignmentResults: the best placement of
+    the shorter sequence and of its reverse complement on the longer one """
+    s1, s2, l1, l2 = order_by_length(seq1, seq2)
+    scores = score_both_strands(s1, s2, method)
+    rc = reverse_complement(s2)
+    if l1 == 0:
+        return (align_at(s1, s2, 0, method=method),
+                align_at(s1, rc, 0, "-", method))
+    forward, reverse = np.argmax(scores, axis=1)
+    return (align_at(s1, s2, int(forward), method=method),
+            align_at(s1, rc, int(reverse), "-", method))
 
-l1 = len(seq1)
-l2 = len(seq2)
-if l1 >= l2:
-    s1 = seq1
-    s2 = seq2
-else:
-    s1 = seq2
-    s2 = seq1
-    l1, l2 = l2, l1 # swap the two lengths
 
 # A function that computes a score by returning the number of matches starting
 # from arbitrary startpoint (chosen by user)
-def calculate_score(s1, s2, l1, l2, startpoint):
-    matched = "" # to hold string displaying alignements
-    score = 0
-    for i in range(l2):
-        if (i + startpoint) < l1:
-            if s1[i + startpoint] == s2[i]: # if the bases match
-                matched = matched + "*"
-                score = score + 1
-            else:
-                matched = matched + "-"
-
-    # some formatted output
-    print("." * startpoint + matched)           
-    print("." * startpoint + s2)
-    print(s1)
-    print(score) 
-    print(" ")
-
+def calculate_score(s1, s2, l1, l2, startpoint, verbose=False):
+    """ Returns the number of matches of s2 placed at startpoint on s1,
+    printing the alignment if verbose is True """
+    a1 = encode(s1)
+    a2 = encode(s2)
+    n = max(0, min(l2, l1 - startpoint))
+    score = int(np.count_nonzero(a1[startpoint:startpoint + n] == a2[:n]))
+    if verbose:
+        print(render_alignment(s1, s2, startpoint, score))
     return score
 
-# Test the function with some example starting points:
-# calculate_score(s1, s2, l1, l2, 0)
-# calculate_score(s1, s2, l1, l2, 1)
-# calculate_score(s1, s2, l1, l2, 5)
-
-# now try to find the best match (highest score) for the two sequences
-my_best_align = None
-my_best_score = -1
-
-for i in range(l1): # Note that you just take the last alignment with the highest score
-    z = calculate_score(s1, s2, l1, l2, i)
-    if z > my_best_score:
-        my_best_align = "." * i + s2 # think about what this is doing!
-        my_best_score = z 
-print(my_best_align)
-print(s1)
-print("Best score:", my_best_score)
+
+def render_alignment(s1, s2, startpoint, score=None):
+    """ Returns a text rendering of s2 placed at startpoint on s1: the match
+    line (* match, - mismatch), the shifted s2, s1 and optionally the score """
+    text = align_at(s1, s2, startpoint).render()
+    if score is not None:
+        text += "\n%d\n " % score
+    return text
+
+
+def _as_str(seq):
+    """ Returns seq as a str for printing """
+    if isinstance(seq, str):
+        return seq
+    return bytes(encode(seq)).decode('ascii')
+
+
+if __name__ == "__main__":
+    # Assign the longer sequence s1, and the shorter to s2
+    # l1 is length of the longest, l2 that of the shortest
+    s1, s2, l1, l2 = order_by_length(seq1, seq2)
+
+    # Test the function with some example starting points:
+    # calculate_score(s1, s2, l1, l2, 0, verbose=True)
+    # calculate_score(s1, s2, l1, l2, 1, verbose=True)
+    # calculate_score(s1, s2, l1, l2, 5, verbose=True)
+
+    # now find the best match (highest score) for the two sequences; note that
+    # argmax takes the first alignment with the highest score
+    best = align(s1, s2)
+    my_best_align = "." * best.offset + s2 # think about what this is doing!
+    print(my_best_align)
+    print(s1)
+    print("Best score:", best.score)
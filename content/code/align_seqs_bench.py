@@ -0,0 +1,105 @@
+"""Benchmark the direct and FFT scoring modes of align_seqs.py.
+
+Run from the code directory:
+
+    python3 align_seqs_bench.py
+
+Times both modes on the two fasta records in ../data/fasta/ and on
+synthetic 1 Mbp inputs, and checks that both modes give the same scores.
+Then splits the time of the old print-every-offset loop of align_seqs.py
+into scoring and building the text renderings, on a 10 kb sequence, and
+compares one-strand with both-strand scoring.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import align_seqs
+from fasta_reader import FastaFile
+from runtools import best_time
+
+FASTA_REF = "../data/fasta/407228412.fasta"
+FASTA_QUERY = "../data/fasta/407228326.fasta"
+
+
+def read_fasta(filename):
+    """ Returns the bases of the first record in a fasta file as uint8 """
+    with FastaFile(filename, write_index=False) as fa:
+        return next(iter(fa)).seq().copy()
+
+
+def random_seq(n, rng):
+    """ Returns a random ACGT sequence of length n as a uint8 array """
+    return np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, n)]
+
+
+def compare(label, s1, s2, direct=True, repeat=3):
+    """ Times both scoring modes on s1, s2 and prints a report line """
+    t_fft, fft_scores = best_time(align_seqs.score_all_offsets_fft, s1, s2,
+                                  repeat=repeat)
+    if direct:
+        t_direct, scores = best_time(align_seqs.score_all_offsets, s1, s2,
+                                     repeat=repeat)
+        same = np.array_equal(scores, fft_scores)
+        print("%-28s direct %9.4f s  fft %9.4f s  speed-up %7.1fx  equal: %s"
+              % (label, t_direct, t_fft, t_direct / t_fft, same))
+        return same
+    print("%-28s direct %9s    fft %9.4f s" % (label, "skipped", t_fft))
+    return True
+
+
+def scoring_vs_rendering(s1, s2):
+    """ Prints the time taken to score every offset of s2 on s1 and to
+    build the text rendering of every offset (without printing it) """
+    start = time.perf_counter()
+    scores = align_seqs.score_all_offsets(s1, s2)
+    t_score = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chars = 0
+    for offset in range(len(s1)):
+        chars += len(align_seqs.render_alignment(s1, s2, offset,
+                                                 scores[offset]))
+    t_render = time.perf_counter() - start
+    print("%-28s score %9.4f s  render %9.4f s  (%.1f MB of text)"
+          % ("all offsets %d x %d" % (len(s1), len(s2)), t_score, t_render,
+             chars / 1e6))
+
+
+def strands(label, s1, s2, method, repeat=1):
+    """ Prints the time of scoring one strand and both strands of s2 """
+    t_one, _ = best_time(align_seqs.best_offset, s1, s2, method, repeat=repeat)
+    t_both, _ = best_time(align_seqs.score_both_strands, s1, s2, method,
+                          repeat=repeat)
+    print("%-28s one strand %9.4f s  both %9.4f s  ratio %5.2f"
+          % (label + " " + method, t_one, t_both, t_both / t_one))
+
+
+def main(argv):
+    rng = np.random.default_rng(1)
+    ok = True
+
+    ref = read_fasta(FASTA_REF)
+    query = read_fasta(FASTA_QUERY)
+    ok &= compare("fasta %d x %d" % (len(ref), len(query)), ref, query)
+
+    mbp = random_seq(1000000, rng)
+    ok &= compare("synthetic 1 Mbp x 2 kbp", mbp, random_seq(2000, rng),
+                  repeat=1)
+    # the direct mode needs 1e12 comparisons here, so only time the FFT
+    ok &= compare("synthetic 1 Mbp x 1 Mbp", mbp, random_seq(1000000, rng),
+                  direct=False, repeat=1)
+
+    scoring_vs_rendering(random_seq(10000, rng).tobytes().decode(),
+                         random_seq(1000, rng).tobytes().decode())
+
+    for method in ("direct", "fft"):
+        strands("1 Mbp x 2 kbp", mbp, random_seq(2000, rng), method)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,47 @@
+"""Align the first records of two fasta files with align_seqs.py.
+
+    python3 align_seqs_fasta.py [seq1.fasta seq2.fasta] [--fft]
+
+Without file arguments the two example files in ../data/fasta/ are used.
+The files are memory-mapped through fasta_reader, so the sequences are
+never turned into Python strings.
+"""
+
+import sys
+
+import align_seqs
+from fasta_reader import FastaFile
+
+DEFAULT_FILES = ["../data/fasta/407228412.fasta",
+                 "../data/fasta/407228326.fasta"]
+
+
+def align_files(filename1, filename2, method="direct"):
+    """ Returns (offset, score, name1, name2) for the best alignment of the
+    shorter first record on the longer one """
+    with FastaFile(filename1) as fa1, FastaFile(filename2) as fa2:
+        rec1 = next(iter(fa1))
+        rec2 = next(iter(fa2))
+        if len(rec1) < len(rec2):
+            rec1, rec2 = rec2, rec1
+        offset, score, _ = align_seqs.best_offset(rec1.seq(), rec2.seq(),
+                                                  method=method)
+        return offset, score, rec1.name, rec2.name
+
+
+def main(argv):
+    args = [a for a in argv[1:] if not a.startswith("--")]
+    method = "fft" if "--fft" in argv else "direct"
+    if len(args) not in (0, 2):
+        print(__doc__)
+        return 1
+    filename1, filename2 = args or DEFAULT_FILES
+    offset, score, name1, name2 = align_files(filename1, filename2, method)
+    print("%s placed on %s at offset %d" % (name2, name1, offset))
+    print("Best score:", score)
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,241 @@
+"""asyncio front-end for SQLite queries.
+
+sqlite3 calls block, so made from a coroutine they stall the event loop
+for as long as the query runs. Here each AsyncConnection owns one SQLite
+connection and the one executor thread that ever touches it; coroutines
+await the queries, and results can be streamed as an async iterator that
+fetches fetchmany() batches, so a large result is never held in memory
+at once. Cancelling a coroutine (or leaving an `async for` early)
+interrupts the statement running for it and closes its cursor.
+
+AsyncPool spreads many concurrent lookups over a few such connections:
+
+    async with AsyncPool("../data/wood.db", size=4) as pool:
+        rows = await pool.fetchall("SELECT * FROM woodb WHERE Family = ?",
+                                   ("Fagaceae",))
+        async for row in pool.iterate("SELECT Binomial FROM woodb"):
+            ...
+
+    python3 async_sqlite.py [DB]
+"""
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+FETCH_BATCH = 500
+DEFAULT_POOL_SIZE = 4
+
+
+class AsyncConnection:
+    """ An SQLite connection used from coroutines through its own thread """
+
+    def __init__(self, path, readonly=True, immutable=False, **connect_kw):
+        self.path = os.path.abspath(path)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite")
+        mode = "ro" if readonly else "rw"
+        uri = "file:%s?mode=%s" % (quote(self.path), mode)
+        if readonly and immutable:
+            uri += "&immutable=1"
+        # created in the executor thread, the only one that uses it
+        self._conn = self._executor.submit(
+            sqlite3.connect, uri, uri=True, **connect_kw).result()
+        self._running = None
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _job(self, token, fn, args):
+        with self._lock:
+            self._running = token
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running = None
+
+    async def _call(self, fn, *args):
+        """ Returns fn(*args) run in the connection's thread; if the caller
+        is cancelled while it runs, the running statement is interrupted """
+        token = object()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._job,
+                                              token, fn, args)
+        except asyncio.CancelledError:
+            with self._lock:
+                if self._running is token:
+                    self._conn.interrupt()
+            raise
+
+    async def execute(self, sql, params=()):
+        """ Runs a statement and commits; returns its rowcount """
+        def run():
+            with self._conn:
+                return self._conn.execute(sql, params).rowcount
+        return await self._call(run)
+
+    async def fetchall(self, sql, params=()):
+        """ Returns all the rows of a query """
+        return await self._call(
+            lambda: self._conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql, params=()):
+        """ Returns the first row of a query, or None """
+        return await self._call(
+            lambda: self._conn.execute(sql, params).fetchone())
+
+    async def batches(self, sql, params=(), size=FETCH_BATCH):
+        """ Yields the rows of a query in lists of up to size rows """
+        cursor = await self._call(self._conn.execute, sql, params)
+        try:
+            while True:
+                rows = await self._call(cursor.fetchmany, size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            # runs after the statement's job, which was interrupted if it
+            # was cancelled; shielded so a cancelled caller still waits
+            await asyncio.shield(self._call(cursor.close))
+
+    async def iterate(self, sql, params=(), size=FETCH_BATCH):
+        """ Yields the rows of a query one at a time, fetched size rows at
+        a time """
+        async with contextlib.aclosing(self.batches(sql, params, size)) as b:
+            async for rows in b:
+                for row in rows:
+                    yield row
+
+    async def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, conn.close)
+        self._executor.shutdown(wait=True)
+
+
+class AsyncPool:
+    """ A fixed number of AsyncConnections handed out to one coroutine at a
+    time """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, **conn_kw):
+        self.path = path
+        self.size = size
+        self.conn_kw = conn_kw
+        self._idle = None
+        self._all = []
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._all = await asyncio.gather(*[
+            loop.run_in_executor(None, lambda: AsyncConnection(
+                self.path, **self.conn_kw)) for _ in range(self.size)])
+        self._idle = asyncio.Queue()
+        for conn in self._all:
+            self._idle.put_nowait(conn)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """ Waits for an idle connection and holds it for the block """
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def fetchall(self, sql, params=()):
+        async with self.acquire() as conn:
+            return await conn.fetchall(sql, params)
+
+    async def fetchone(self, sql, params=()):
+        async with self.acquire() as conn:
+            return await conn.fetchone(sql, params)
+
+    async def iterate(self, sql, params=(), size=FETCH_BATCH):
+        """ Yields the rows of a query, holding one connection until the
+        iteration ends """
+        async with self.acquire() as conn:
+            async with contextlib.aclosing(conn.iterate(sql, params,
+                                                        size)) as rows:
+                async for row in rows:
+                    yield row
+
+    async def close(self):
+        await asyncio.gather(*[conn.close() for conn in self._all])
+        self._all = []
+
+
+async def _demo(db):
+    loop = asyncio.get_running_loop()
+    async with AsyncPool(db, size=4, immutable=True) as pool:
+        names = [n for (n,) in await pool.fetchall(
+            "SELECT Binomial FROM woodb")]
+
+        # a heartbeat shows whether the loop stays responsive
+        beats = 0
+
+        async def heartbeat():
+            nonlocal beats
+            while True:
+                await asyncio.sleep(0.001)
+                beats += 1
+
+        hb = asyncio.create_task(heartbeat())
+        start = loop.time()
+        rows = await asyncio.gather(*[pool.fetchone(
+            "SELECT WoodDensity FROM woodb WHERE Binomial = ?", (name,))
+            for name in names[:5000]])
+        elapsed = loop.time() - start
+        print("%d concurrent lookups in %.3f s, %d heartbeats meanwhile"
+              % (len(rows), elapsed, beats))
+
+        n = 0
+        async for _ in pool.iterate("SELECT * FROM woodb", size=1000):
+            n += 1
+        print("streamed %d rows in batches of 1000" % n)
+
+        # a cross join far too big to finish, cancelled after 0.2 s
+        async def huge():
+            count = 0
+            async for _ in pool.iterate("SELECT a.Number FROM woodb a, "
+                                        "woodb b ORDER BY a.Number + b.Number"):
+                count += 1
+            return count
+
+        start = loop.time()
+        try:
+            await asyncio.wait_for(huge(), 0.2)
+        except asyncio.TimeoutError:
+            print("huge query cancelled after %.3f s" % (loop.time() - start))
+        print("pool still usable:",
+              await pool.fetchone("SELECT COUNT(*) FROM woodb"))
+        hb.cancel()
+
+
+def main(argv):
+    db = argv[1] if len(argv) > 1 else "../data/wood.db"
+    asyncio.run(_demo(db))
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
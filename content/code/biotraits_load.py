@@ -0,0 +1,175 @@
+"""Bulk load the Biotraits CSV tables into an SQLite database.
+
+The Databases appendix builds Biotraits.db by hand in the sqlite3 shell
+(CREATE TABLE, then .import TraitInfo.csv, Consumer.csv and TCP.csv), and
+pythonsql.py inserts rows one execute() at a time, each in its own
+transaction. Here every CSV is streamed through csv.reader into
+executemany() in batches of BATCH_SIZE rows, all tables in one
+transaction, with the journal in WAL mode and synchronous=OFF while
+loading; the indexes are only built once the rows are in, and the
+database's own journal mode is restored at the end.
+
+Values are stored as .import stores them: as text, converted by the
+column type affinity, with "NA" kept as a string unless null_values says
+otherwise.
+
+    counts = bulk_load("../results/Biotraits.db")
+
+    python3 biotraits_load.py [DB] [--data DIR] [--batch N] [--na-null]
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+import sys
+import time
+
+DATA_DIR = "../data"
+DEFAULT_DB = "../results/Biotraits.db"
+BATCH_SIZE = 50000
+
+# table -> (columns as in the Databases appendix, CSV file, indexes)
+TABLES = {
+    "TraitInfo": ("""Numbers integer primary key,
+                     OriginalID text,
+                     FinalID text,
+                     OriginalTraitName text,
+                     OriginalTraitDef text,
+                     Replicates integer,
+                     Habitat integer,
+                     Climate text,
+                     Location text,
+                     LocationType text,
+                     LocationDate text,
+                     CoordinateType text,
+                     Latitude integer,
+                     Longitude integer""",
+                  "TraitInfo.csv",
+                  ["FinalID"]),
+    "Consumer": ("""Numbers integer primary key,
+                    OriginalID text,
+                    FinalID text,
+                    Consumer text,
+                    ConCommon text,
+                    ConKingdom text,
+                    ConPhylum text,
+                    ConClass text,
+                    ConOrder text,
+                    ConFamily text,
+                    ConGenus text,
+                    ConSpecies text""",
+                 "Consumer.csv",
+                 ["FinalID", "ConSpecies"]),
+    "TCP": ("""Numbers integer primary key,
+               OriginalID text,
+               FinalID text,
+               OriginalTraitValue integer,
+               OriginalTraitUnit text,
+               LabGrowthTemp integer,
+               LabGrowthTempUnit text,
+               ConTemp integer,
+               ConTempUnit text,
+               ConTempMethod text,
+               ConAcc text,
+               ConAccTemp integer""",
+            "TCP.csv",
+            ["FinalID"]),
+}
+
+
+def _batches(rows, batch_size):
+    """ Yields lists of at most batch_size rows """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _nulls(rows, null_values):
+    """ Yields rows with the values in null_values replaced by None """
+    for row in rows:
+        yield [None if v in null_values else v for v in row]
+
+
+def load_csv(conn, table, filename, n_columns, batch_size=BATCH_SIZE,
+             null_values=()):
+    """ Inserts the rows of a header-less CSV file into table; returns the
+    number of rows. Runs in the connection's current transaction """
+    sql = "INSERT INTO %s VALUES (%s)" % (table, ",".join("?" * n_columns))
+    count = 0
+    with open(filename, newline='') as f:
+        rows = csv.reader(f)
+        if null_values:
+            rows = _nulls(rows, frozenset(null_values))
+        for batch in _batches(rows, batch_size):
+            conn.executemany(sql, batch)
+            count += len(batch)
+    return count
+
+
+def bulk_load(db, data_dir=DATA_DIR, tables=TABLES, batch_size=BATCH_SIZE,
+              null_values=()):
+    """ (Re)creates tables in db from their CSV files in data_dir, then
+    their indexes; returns {table: (rows, seconds)} """
+    conn = sqlite3.connect(db, isolation_level=None)
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        stats = {}
+        conn.execute("BEGIN")
+        try:
+            for table, (columns, filename, indexes) in tables.items():
+                start = time.perf_counter()
+                conn.execute("DROP TABLE IF EXISTS %s" % table)
+                conn.execute("CREATE TABLE %s (%s)" % (table, columns))
+                n = load_csv(conn, table, os.path.join(data_dir, filename),
+                             len(columns.split(",")), batch_size, null_values)
+                stats[table] = (n, time.perf_counter() - start)
+            # deferred until the rows are in: one sort per index instead of
+            # an index update per row
+            for table, (_, _, indexes) in tables.items():
+                start = time.perf_counter()
+                for column in indexes:
+                    conn.execute("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)"
+                                 % (table, column, table, column))
+                n, seconds = stats[table]
+                stats[table] = (n, seconds + time.perf_counter() - start)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA journal_mode=%s" % journal_mode)
+    finally:
+        conn.close()
+    return stats
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db", nargs="?", default=DEFAULT_DB,
+                        help="database file (default: %(default)s)")
+    parser.add_argument("--data", default=DATA_DIR,
+                        help="directory of the CSV files (default: "
+                             "%(default)s)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE,
+                        help="rows per executemany() (default: %(default)s)")
+    parser.add_argument("--na-null", action="store_true",
+                        help="store NA values as NULL")
+    args = parser.parse_args(argv[1:])
+    start = time.perf_counter()
+    stats = bulk_load(args.db, args.data, batch_size=args.batch,
+                      null_values=("NA",) if args.na_null else ())
+    for table, (n, seconds) in stats.items():
+        print("%-10s %8d rows %9.4f s" % (table, n, seconds))
+    print("total %.4f s -> %s" % (time.perf_counter() - start, args.db))
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,57 @@
+"""Benchmark email_extract.py against the email regex of re4.py.
+
+Run from the code directory:
+
+    python3 email_extract_bench.py
+
+Times both on adversarial inputs of growing size (long runs of address
+characters with no valid address, where the regex is quadratic) and on a
+text with many real addresses, and checks that both find the same ones.
+"""
+
+import re
+
+import email_extract
+from runtools import best_time
+
+EMAIL_RE = re.compile(
+    r'[a-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-z0-9!\#$%&\'*+/=?^_`{|}~-]+)*'
+    r'@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?')
+
+SIZES = (1000, 2000, 4000, 8000)
+
+# name -> function of n returning an input of about n characters or more
+ADVERSARIAL = {
+    "no '@'": lambda n: "a" * n,
+    "local part, no domain": lambda n: "a" * n + "@",
+    "dotted local part": lambda n: "a.a" * (n // 3) + "@-",
+    "domain without dot": lambda n: "x@" + "a" * n,
+    "hyphenated domain": lambda n: "x@" + "a-" * (n // 2),
+}
+
+
+def compare(label, text, repeat=3):
+    """ Times the regex and the extractor on text and prints a report line """
+    t_re, found_re = best_time(EMAIL_RE.findall, text, repeat=repeat)
+    t_ex, found = best_time(email_extract.extract_emails, text, repeat=repeat)
+    same = found_re == found
+    print("%-34s regex %9.4f s  extractor %9.4f s  speed-up %8.1fx  equal: %s"
+          % (label, t_re, t_ex, t_re / max(t_ex, 1e-9), same))
+    return same
+
+
+def main():
+    ok = True
+    for name, make in ADVERSARIAL.items():
+        for n in SIZES:
+            ok &= compare("%s, n=%d" % (name, n), make(n))
+    page = " ".join("<td>user%d.name@dept%d.example.ac.uk</td>" % (i, i % 7)
+                    for i in range(20000))
+    ok &= compare("20000 addresses in HTML", page)
+    print("all equal" if ok else "MISMATCH")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Memory-mapped, indexed reader for (multi-record) FASTA files.
+
+The file is memory-mapped rather than read, and the byte offset and line
+layout of every record are indexed the way `samtools faidx` does it (a .fai
+file, which is written next to the FASTA and reused while it is newer than
+the FASTA). Records are yielded lazily and expose their bases as NumPy uint8
+views onto the mapping, so multi-gigabyte files can be aligned without
+turning every sequence into a Python string.
+
+A record whose lines are not all as long as its first one (other than the
+last) cannot be described by a .fai line; `samtools faidx` refuses such a
+file. Here its bases are copied, newlines stripped, into an array of their
+own, and no .fai is written for the file.
+
+    with FastaFile("../data/fasta/407228412.fasta") as fa:
+        for record in fa:
+            print(record.name, len(record))
+            seq = record.seq() # uint8 array, no newlines
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+
+# Bytes examined at a time when counting newlines in a record
+SCAN_CHUNK = 2 ** 26
+
+
+class FastaRecord:
+    """ One record of a FastaFile, described by its .fai fields:
+    name, length (bases), offset (byte offset of the first base), linebases
+    (bases per line) and linewidth (bytes per line, newline included).
+    For a record with uneven lines, buf holds a copy of just its bases """
+
+    __slots__ = ("name", "description", "length", "offset", "linebases",
+                 "linewidth", "_buf")
+
+    def __init__(self, buf, name, length, offset, linebases, linewidth,
+                 description=""):
+        self._buf = buf
+        self.name = name
+        self.description = description
+        self.length = length
+        self.offset = offset
+        self.linebases = linebases
+        self.linewidth = linewidth
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "FastaRecord(%r, length=%d)" % (self.name, self.length)
+
+    def _nbytes(self):
+        """ Returns the number of bytes from the first to the last base """
+        if self.length == 0:
+            return 0
+        full_lines, last = divmod(self.length, self.linebases)
+        if last == 0:
+            return (full_lines - 1) * self.linewidth + self.linebases
+        return full_lines * self.linewidth + last
+
+    def raw(self):
+        """ Returns a zero-copy uint8 view of the record's sequence bytes,
+        newlines included """
+        return self._buf[self.offset:self.offset + self._nbytes()]
+
+    def lines(self):
+        """ Returns a zero-copy (n_lines, linebases) uint8 view of the full
+        sequence lines, skipping the newlines, and a view of the shorter last
+        line (empty if the last line is full) """
+        full_lines = self.length // self.linebases if self.length else 0
+        rows = np.lib.stride_tricks.as_strided(
+            self._buf[self.offset:], shape=(full_lines, self.linebases),
+            strides=(self.linewidth, 1), writeable=False)
+        start = self.offset + full_lines * self.linewidth
+        tail = self._buf[start:start + self.length - full_lines * self.linebases]
+        return rows, tail
+
+    def seq(self):
+        """ Returns the bases as a contiguous uint8 array without newlines;
+        this is a zero-copy view when the record sits on a single line """
+        if self.length <= self.linebases:
+            return self._buf[self.offset:self.offset + self.length]
+        rows, tail = self.lines()
+        out = np.empty(self.length, dtype=np.uint8)
+        body = rows.size
+        out[:body] = rows.reshape(-1)
+        out[body:] = tail
+        return out
+
+    def __str__(self):
+        return self.seq().tobytes().decode('ascii')
+
+
+class FastaFile:
+    """ A memory-mapped FASTA file. Iterating yields FastaRecord objects;
+    records can also be looked up by name. Views handed out by the records
+    are only valid while the file is open. """
+
+    def __init__(self, filename, write_index=True):
+        self.filename = filename
+        self.write_index = write_index
+        self._file = open(filename, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._mmap = None
+            self._buf = np.zeros(0, dtype=np.uint8)
+        else:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self._buf = np.frombuffer(self._mmap, dtype=np.uint8)
+        self._index = None
+        self._by_name = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Unmaps and closes the file """
+        self._buf = None
+        self._index = None
+        self._by_name = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # record views still exist; unmapped when they are freed
+            self._mmap = None
+        self._file.close()
+
+    @property
+    def fai_filename(self):
+        return self.filename + ".fai"
+
+    def __iter__(self):
+        if self._index is not None:
+            return iter(self._index)
+        return self._scan()
+
+    def __getitem__(self, name):
+        self.index()
+        return self._by_name[name]
+
+    def __len__(self):
+        return len(self.index())
+
+    def index(self):
+        """ Returns the list of records, reading the .fai index when it is up
+        to date and building (and optionally writing) it otherwise """
+        if self._index is None:
+            records = self._read_fai()
+            if records is None:
+                records = list(self._scan())
+                if self.write_index and all(r._buf is self._buf
+                                            for r in records):
+                    self._write_fai(records)
+            self._index = records
+            # the first record of a name wins, as in a scan of the file
+            self._by_name = {}
+            for record in records:
+                self._by_name.setdefault(record.name, record)
+        return self._index
+
+    def _scan(self):
+        """ Yields records in file order by scanning the mapping for headers """
+        buf = self._buf
+        mm = self._mmap
+        size = len(buf)
+        if size == 0:
+            return
+        if buf[0] == ord('>'):
+            pos = 0
+        else:
+            pos = mm.find(b"\n>")
+            if pos < 0:
+                return
+            pos += 1
+        while True:
+            header_end = mm.find(b"\n", pos)
+            if header_end < 0:
+                header_end = size
+            header = bytes(buf[pos + 1:header_end]).decode().rstrip('\r')
+            name, _, description = header.partition(" ")
+            start = min(header_end + 1, size)
+            # search from the header's own newline so an empty record is
+            # still followed by the next header
+            next_header = mm.find(b"\n>", header_end) if header_end < size else -1
+            end = size if next_header < 0 else next_header + 1
+            yield _make_record(mm, buf, name, description, start, end)
+            if next_header < 0:
+                break
+            pos = next_header + 1
+
+    def _read_fai(self):
+        """ Returns records from an up to date .fai file, or None """
+        try:
+            if (os.path.getmtime(self.fai_filename)
+                    < os.path.getmtime(self.filename)):
+                return None
+            records = []
+            with open(self.fai_filename, 'r') as f:
+                for line in f:
+                    name, length, offset, linebases, linewidth = \
+                        line.rstrip('\n').split('\t')[:5]
+                    records.append(FastaRecord(
+                        self._buf, name, int(length), int(offset),
+                        int(linebases), int(linewidth)))
+            return records
+        except (OSError, ValueError):
+            return None
+
+    def _write_fai(self, records):
+        try:
+            with open(self.fai_filename, 'w') as f:
+                for r in records:
+                    f.write("%s\t%d\t%d\t%d\t%d\n" % (
+                        r.name, r.length, r.offset, r.linebases, r.linewidth))
+        except OSError:
+            pass # read-only data directory; keep the index in memory
+
+
+def _make_record(mm, buf, name, description, start, end):
+    """ Returns the FastaRecord whose sequence occupies buf[start:end] """
+    # bases per line and bytes per line, from the first sequence line
+    first_nl = mm.find(b"\n", start, end)
+    if first_nl < 0:
+        linewidth = end - start
+        linebases = linewidth
+    else:
+        linewidth = first_nl - start + 1
+        linebases = linewidth - 1
+    crlf = linebases > 0 and buf[start + linebases - 1] == CARRIAGE_RETURN
+    if crlf:
+        linebases -= 1
+
+    newlines = returns = 0
+    for chunk_start in range(start, end, SCAN_CHUNK):
+        chunk = buf[chunk_start:min(chunk_start + SCAN_CHUNK, end)]
+        newlines += np.count_nonzero(chunk == NEWLINE)
+        returns += np.count_nonzero(chunk == CARRIAGE_RETURN)
+    length = end - start - newlines - returns
+    record = FastaRecord(buf, name, length, start, linebases, linewidth,
+                         description)
+    if length and not _regular(buf, record, newlines, returns, crlf):
+        bases = buf[start:end]
+        bases = bases[(bases != NEWLINE) & (bases != CARRIAGE_RETURN)]
+        record = FastaRecord(bases, name, length, 0, length, length,
+                             description)
+    return record
+
+
+def _regular(buf, record, newlines, returns, crlf):
+    """ Returns True if every line of record but the last holds linebases
+    bases, given the numbers of newlines and carriage returns in it """
+    if record.linebases == 0:
+        return False
+    n_lines = -(-record.length // record.linebases)
+    # the last line's newline is missing at the end of the file
+    if newlines not in (n_lines, n_lines - 1):
+        return False
+    if returns != (newlines if crlf else 0):
+        return False
+    # the newlines counted are exactly those the layout puts at the end of
+    # every line
+    full_lines, last = divmod(record.length, record.linebases)
+    eol = 2 if crlf else 1
+    ends = np.lib.stride_tricks.as_strided(
+        buf[record.offset + record.linebases:],
+        shape=(min(full_lines, newlines), eol),
+        strides=(record.linewidth, 1), writeable=False)
+    if last and newlines == n_lines:
+        tail = record.offset + full_lines * record.linewidth + last
+        ends = np.vstack([ends, buf[tail:tail + eol]])
+    line_end = np.frombuffer(b"\r\n" if crlf else b"\n", dtype=np.uint8)
+    return bool(np.all(ends == line_end))
+
+
+def read_fasta(filename):
+    """ Yields the records of a fasta file one at a time; the file stays
+    mapped until the generator is exhausted or closed """
+    with FastaFile(filename) as fa:
+        yield from fa
+
+
+if __name__ == "__main__":
+    import sys
+    for fn in sys.argv[1:] or ["../data/fasta/407228412.fasta"]:
+        with FastaFile(fn, write_index=False) as fa:
+            for rec in fa:
+                print(rec.name, len(rec), rec.description)
@@ -0,0 +1,362 @@
+"""Gapped global (Needleman-Wunsch) and local (Smith-Waterman) alignment.
+
+align_seqs.py only slides one sequence along the other; here gaps are
+allowed, with affine gap costs (Gotoh): a gap of length k costs
+gap_open + gap_extend * (k - 1).
+
+The dynamic programming matrix is filled one anti-diagonal (i + j = d) at a
+time: every cell on a diagonal depends only on the two previous diagonals,
+so each diagonal is a handful of NumPy operations instead of a Python loop
+over cells. Scores alone need just three diagonals (linear memory); full
+alignments are recovered with Hirschberg's divide and conquer in the
+affine-gap form of Myers & Miller (1988), also in linear memory.
+
+For near-identical sequences banded_align() fills only the cells within w
+of the main diagonal, O(n w) time and memory, doubling w until the best
+path in the band provably scores at least as well as any path leaving it.
+
+    >>> global_align("GATTACA", "GCATGCT").score
+    2
+    >>> aln = local_align("TTTTGATTACATTTT", "CCGATTACACC")
+    >>> aln.aligned1, aln.aligned2, aln.score
+    ('GATTACA', 'GATTACA', 14)
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from align_seqs import encode
+
+Scoring = namedtuple("Scoring", "match mismatch gap_open gap_extend")
+DEFAULT_SCORING = Scoring(match=2, mismatch=-1, gap_open=3, gap_extend=1)
+
+Alignment = namedtuple("Alignment",
+                       "score aligned1 aligned2 start1 end1 start2 end2")
+
+# Score standing in for minus infinity; far from overflowing int64
+NEG = -(2 ** 60)
+
+# Sub-problems up to this many cells are solved with a full matrix
+FULL_DP_CELLS = 2 ** 20
+
+# Initial half-width of the band used by banded_align()
+DEFAULT_BAND = 32
+
+# Transcript operations: aligned pair, gap in s2, gap in s1
+MATCH, DELETE, INSERT = ord('M'), ord('D'), ord('I')
+
+
+def _gap_costs(scoring):
+    """ Returns (g, h) such that a gap of length k costs g + h * k """
+    return scoring.gap_open - scoring.gap_extend, scoring.gap_extend
+
+
+def _diagonals(a, b, scoring, local=False, tb=None, band=None):
+    """ Fills the DP matrix of a (rows) against b (columns) by anti-diagonals.
+
+    Yields (d, lo, hi, H, E, F) for d = 0 .. len(a) + len(b): cell (i, d - i)
+    of diagonal d is at position i + 1 of the buffers for lo <= i <= hi. H is
+    the best score of a path ending in the cell, E of one ending with a gap
+    in a (horizontal move) and F with a gap in b (vertical move). The
+    buffers are reused, so each diagonal must be consumed before the next.
+
+    tb is the opening cost g of a vertical gap running down from the top
+    left corner (0 when it continues a gap of an enclosing problem). With a
+    band, only cells with |i - j| <= band are filled.
+    """
+    n, m = len(a), len(b)
+    g, h = _gap_costs(scoring)
+    tb = g if tb is None else tb
+    b_rev = b[::-1]
+    bufs = [tuple(np.full(n + 3, NEG, dtype=np.int64) for _ in range(3))
+            for _ in range(3)]
+
+    for d in range(n + m + 1):
+        lo, hi = max(0, d - m), min(n, d)
+        if band is not None:
+            lo, hi = max(lo, (d - band + 1) // 2), min(hi, (d + band) // 2)
+        H, E, F = bufs[d % 3]
+        H1, E1, F1 = bufs[(d - 1) % 3]
+        H2 = bufs[(d - 2) % 3][0]
+
+        # interior cells (i >= 1 and j >= 1)
+        i0, i1 = max(lo, 1), min(hi, d - 1)
+        if i0 <= i1:
+            at_i = slice(i0 + 1, i1 + 2)
+            at_im1 = slice(i0, i1 + 1)
+            s = np.where(a[i0 - 1:i1] == b_rev[m - d + i0:m - d + i1 + 1],
+                         scoring.match, scoring.mismatch)
+            e = np.maximum(E1[at_i] - h, H1[at_i] - (g + h))
+            f = np.maximum(F1[at_im1] - h, H1[at_im1] - (g + h))
+            cell = np.maximum(np.maximum(H2[at_im1] + s, e), f)
+            if local:
+                np.maximum(cell, 0, out=cell)
+            H[at_i], E[at_i], F[at_i] = cell, e, f
+
+        # boundary cells: top row (0, d) and left column (d, 0)
+        if lo == 0:
+            if d == 0:
+                H[1], E[1], F[1] = 0, NEG, NEG
+            else:
+                H[1] = 0 if local else -(g + h * d)
+                E[1] = NEG if local else H[1]
+                F[1] = NEG
+        if hi == d and d > 0:
+            H[d + 1] = 0 if local else -(tb + h * d)
+            F[d + 1] = NEG if local else H[d + 1]
+            E[d + 1] = NEG
+
+        # the next two diagonals read at most one cell beyond [lo, hi]
+        H[lo] = E[lo] = F[lo] = NEG
+        if hi + 2 < n + 3:
+            H[hi + 2] = E[hi + 2] = F[hi + 2] = NEG
+        yield d, lo, hi, H, E, F
+
+
+def align_score(s1, s2, local=False, scoring=DEFAULT_SCORING):
+    """ Returns the best global (or local) alignment score of s1 and s2,
+    keeping only three anti-diagonals in memory """
+    if local:
+        return _local_end(encode(s1), encode(s2), scoring)[0]
+    a, b = encode(s1), encode(s2)
+    for d, lo, hi, H, E, F in _diagonals(a, b, scoring):
+        pass
+    return int(H[len(a) + 1])
+
+
+def _local_end(a, b, scoring, local=True):
+    """ Returns (score, i, j) of the best-scoring cell, scanning diagonals
+    in order (ties go to the first cell found) """
+    best, best_i, best_j = 0, 0, 0
+    for d, lo, hi, H, E, F in _diagonals(a, b, scoring, local=local):
+        k = int(np.argmax(H[lo + 1:hi + 2]))
+        if H[lo + 1 + k] > best:
+            best, best_i, best_j = int(H[lo + 1 + k]), lo + k, d - lo - k
+    return best, best_i, best_j
+
+
+def _last_row(a, b, scoring, tb):
+    """ Returns (CC, DD): H and F along the last row of the DP matrix """
+    n, m = len(a), len(b)
+    CC = np.empty(m + 1, dtype=np.int64)
+    DD = np.empty(m + 1, dtype=np.int64)
+    for d, lo, hi, H, E, F in _diagonals(a, b, scoring, tb=tb):
+        if d >= n:
+            CC[d - n] = H[n + 1]
+            DD[d - n] = F[n + 1]
+    return CC, DD
+
+
+def _fill(a, b, scoring, tb, band=None):
+    """ Returns (lows, H, E, F) with every diagonal of the DP matrix kept:
+    row d of H, E and F holds cells i = lows[d], lows[d] + 1, ... of
+    diagonal d, so a band of half-width w needs only w + 1 columns """
+    n, m = len(a), len(b)
+    width = min(n, m) + 1 if band is None else min(min(n, m), band) + 1
+    lows = np.zeros(n + m + 1, dtype=np.int64)
+    Hs = np.full((n + m + 1, width), NEG, dtype=np.int64)
+    Es = np.full_like(Hs, NEG)
+    Fs = np.full_like(Hs, NEG)
+    for d, lo, hi, H, E, F in _diagonals(a, b, scoring, tb=tb, band=band):
+        lows[d] = lo
+        k = hi - lo + 1
+        Hs[d, :k], Es[d, :k], Fs[d, :k] = (H[lo + 1:hi + 2], E[lo + 1:hi + 2],
+                                           F[lo + 1:hi + 2])
+    return lows, Hs, Es, Fs
+
+
+def _traceback(a, b, scoring, store, te):
+    """ Returns the transcript of an optimal global alignment, tracing back
+    through the diagonals kept by _fill(). te is the opening cost of a
+    vertical gap ending in the bottom right corner. """
+    n, m = len(a), len(b)
+    g, h = _gap_costs(scoring)
+    lows, Hs, Es, Fs = store
+    width = Hs.shape[1]
+
+    def cell(M, i, j):
+        k = i - lows[i + j]
+        return M[i + j, k] if 0 <= k < width else NEG
+
+    ops = bytearray()
+    i, j = n, m
+    state = 'F' if cell(Fs, n, m) + g - te > cell(Hs, n, m) else 'H'
+    while i > 0 and j > 0:
+        if state == 'H':
+            s = scoring.match if a[i - 1] == b[j - 1] else scoring.mismatch
+            here = cell(Hs, i, j)
+            if here == cell(Hs, i - 1, j - 1) + s:
+                ops.append(MATCH)
+                i, j = i - 1, j - 1
+            elif here == cell(Es, i, j):
+                state = 'E'
+            else:
+                state = 'F'
+        elif state == 'E':
+            ops.append(INSERT)
+            if cell(Es, i, j) == cell(Hs, i, j - 1) - (g + h):
+                state = 'H'
+            j -= 1
+        else:
+            ops.append(DELETE)
+            if cell(Fs, i, j) == cell(Hs, i - 1, j) - (g + h):
+                state = 'H'
+            i -= 1
+    ops.extend(bytes([DELETE]) * i)
+    ops.extend(bytes([INSERT]) * j)
+    ops.reverse()
+    return bytes(ops)
+
+
+def _full_transcript(a, b, scoring, tb, te):
+    """ Returns the transcript of an optimal global alignment of a and b
+    from the full DP matrix. tb and te are the opening costs of a vertical
+    gap touching the top left and bottom right corners. """
+    if len(b) == 0:
+        return bytes([DELETE]) * len(a)
+    if len(a) == 0:
+        return bytes([INSERT]) * len(b)
+    return _traceback(a, b, scoring, _fill(a, b, scoring, tb), te)
+
+
+def _hirschberg(a, b, scoring, tb, te, ops):
+    """ Appends an optimal global alignment transcript of a and b to ops,
+    splitting on the middle row of a (Myers & Miller) """
+    n, m = len(a), len(b)
+    g = _gap_costs(scoring)[0]
+    if m == 0:
+        ops.extend(bytes([DELETE]) * n)
+        return
+    if n <= 1 or n * m <= FULL_DP_CELLS:
+        ops.extend(_full_transcript(a, b, scoring, tb, te))
+        return
+
+    mid = n // 2
+    CC, DD = _last_row(a[:mid], b, scoring, tb)
+    RR, SS = _last_row(a[mid:][::-1], b[::-1], scoring, te)
+    RR, SS = RR[::-1], SS[::-1]
+    # either the path crosses the middle row at a cell (type 1), or a
+    # vertical gap runs through it, deleting a[mid - 1] and a[mid] (type 2)
+    through = CC + RR
+    gap = DD + SS + g
+    j1, j2 = int(np.argmax(through)), int(np.argmax(gap))
+    if through[j1] >= gap[j2]:
+        _hirschberg(a[:mid], b[:j1], scoring, tb, g, ops)
+        _hirschberg(a[mid:], b[j1:], scoring, g, te, ops)
+    else:
+        _hirschberg(a[:mid - 1], b[:j2], scoring, tb, 0, ops)
+        ops.extend(bytes([DELETE, DELETE]))
+        _hirschberg(a[mid + 1:], b[j2:], scoring, 0, te, ops)
+
+
+def _render(a, b, ops):
+    """ Returns the two gapped sequences spelled out by a transcript """
+    ops = np.frombuffer(bytes(ops), dtype=np.uint8)
+    top = np.full(len(ops), ord('-'), dtype=np.uint8)
+    bottom = top.copy()
+    top[ops != INSERT] = a
+    bottom[ops != DELETE] = b
+    return top.tobytes().decode('ascii'), bottom.tobytes().decode('ascii')
+
+
+def transcript_score(a, b, ops, scoring=DEFAULT_SCORING):
+    """ Returns the score of an alignment transcript of a and b """
+    a, b = encode(a), encode(b)
+    score, i, j, prev = 0, 0, 0, None
+    for op in bytes(ops):
+        if op == MATCH:
+            score += scoring.match if a[i] == b[j] else scoring.mismatch
+            i, j = i + 1, j + 1
+        else:
+            score -= scoring.gap_extend if op == prev else scoring.gap_open
+            if op == DELETE:
+                i += 1
+            else:
+                j += 1
+        prev = op
+    return score
+
+
+def global_align(s1, s2, scoring=DEFAULT_SCORING):
+    """ Returns the optimal global (Needleman-Wunsch / Gotoh) Alignment of
+    s1 and s2, computed in linear memory """
+    a, b = encode(s1), encode(s2)
+    g = _gap_costs(scoring)[0]
+    ops = bytearray()
+    _hirschberg(a, b, scoring, g, g, ops)
+    aligned1, aligned2 = _render(a, b, ops)
+    return Alignment(transcript_score(a, b, ops, scoring), aligned1, aligned2,
+                     0, len(a), 0, len(b))
+
+
+def local_align(s1, s2, scoring=DEFAULT_SCORING):
+    """ Returns the optimal local (Smith-Waterman / Gotoh) Alignment of s1
+    and s2, computed in linear memory.
+
+    A forward local pass finds where the best alignment ends; a pass over
+    the reversed prefixes anchored at that end finds where it starts; the
+    segment in between is then aligned globally.
+    """
+    a, b = encode(s1), encode(s2)
+    score, end1, end2 = _local_end(a, b, scoring)
+    if score == 0:
+        return Alignment(0, "", "", 0, 0, 0, 0)
+    _, len1, len2 = _local_end(a[:end1][::-1], b[:end2][::-1], scoring,
+                               local=False)
+    start1, start2 = end1 - len1, end2 - len2
+    aln = global_align(a[start1:end1], b[start2:end2], scoring)
+    return Alignment(aln.score, aln.aligned1, aln.aligned2,
+                     start1, end1, start2, end2)
+
+
+def _outside_band_bound(n, m, w, scoring):
+    """ Returns an upper bound on the score of any global alignment of
+    lengths n and m with a cell outside the band |i - j| <= w: every pair
+    a match, and the fewest gaps that reach the cell and return """
+    g, h = _gap_costs(scoring)
+    best = NEG
+    # insertions minus deletions must end at m - n; reaching j - i = w + 1
+    # takes w + 1 insertions, i - j = w + 1 as many deletions
+    for inserts, deletes in ((w + 1, w + 1 - (m - n)),
+                             (w + 1 + (m - n), w + 1)):
+        gaps = inserts + deletes
+        cost = 2 * g + h * gaps if g >= 0 else (g + h) * gaps
+        best = max(best, scoring.match * (m - inserts) - cost)
+    return best
+
+
+def banded_align(s1, s2, band=DEFAULT_BAND, scoring=DEFAULT_SCORING):
+    """ Returns the global Alignment of s1 and s2 found within a band of
+    half-width w around the main diagonal (cells with |i - j| <= w).
+
+    w starts at band (widened to exceed the length difference) and doubles
+    until the best path in the band scores at least _outside_band_bound(),
+    so the result is always optimal; dissimilar sequences end up filling
+    the whole matrix. Costs O((n + m) w) time and memory.
+
+    >>> s1, s2 = "ACGT" * 20, "ACGT" * 15
+    >>> banded_align(s1, s2, band=2).score == global_align(s1, s2).score
+    True
+    """
+    a, b = encode(s1), encode(s2)
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return global_align(a, b, scoring)
+    g = _gap_costs(scoring)[0]
+    w = max(band, abs(n - m) + 1)
+    while True:
+        full = w >= max(n, m)
+        store = _fill(a, b, scoring, g, None if full else w)
+        ops = _traceback(a, b, scoring, store, g)
+        score = transcript_score(a, b, ops, scoring)
+        if full or score >= _outside_band_bound(n, m, w, scoring):
+            break
+        w *= 2
+    aligned1, aligned2 = _render(a, b, ops)
+    return Alignment(score, aligned1, aligned2, 0, n, 0, m)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,241 @@
+"""Bulk loader and monthly/yearly means for GHCN-Daily temperature files.
+
+temperatures.py is the exercise of pulling records out of a text file with
+a regex, one city at a time. The files in ../data/Temperatures/ are
+GHCN-Daily CSV rows without a header,
+
+    station,YYYYMMDD,element,value,mflag,qflag,sflag,obstime
+    EZE00100082,18000101,TMAX,-86,,,E,
+
+with values in tenths of a degree C. Here each file is parsed in one
+pandas.read_csv call straight into typed columns (station and element as
+categoricals, date as int32, value as int16 tenths of a degree), rows that
+failed a quality check (non-empty qflag) are dropped, files are parsed by
+a process pool, and the means are group-by reductions over the combined
+table:
+
+    df = load(glob.glob("../data/Temperatures/*.csv"))
+    yearly_means(df)      # station, year -> TMAX, TMIN in degrees C
+    monthly_means(df)     # station, year, month -> TMAX, TMIN
+
+Re-runs need not parse every file again: AggregateCache keeps per-file
+partial aggregates (sum, count, min, max of each station, element, year
+and month) on disk, keyed by file path, size and modification time, and
+parses only new or changed files before merging the partials; entries of
+files no longer asked for are dropped:
+
+    cache = AggregateCache("../results/ghcn_aggregates.pkl")
+    partials = cache.partials(glob.glob("../data/Temperatures/*.csv"))
+    means_from_partials(partials, monthly=False)
+
+    python3 ghcn_temperatures.py [-m] [-j JOBS] [--no-cache] [FILE ...]
+"""
+
+import argparse
+import glob
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from runtools import add_jobs_argument
+
+DATA_GLOB = "../data/Temperatures/*.csv"
+DEFAULT_CACHE = "../results/ghcn_aggregates.pkl"
+
+COLUMNS = ["station", "date", "element", "value", "mflag", "qflag",
+           "sflag", "obstime"]
+ELEMENTS = ("TMAX", "TMIN")
+
+DTYPES = {"station": "category", "date": "int32", "element": "category",
+          "value": "int16", "qflag": "category"}
+
+
+def read_ghcn(filename, elements=ELEMENTS):
+    """ Returns the rows of one GHCN-Daily file for the given elements as a
+    DataFrame with columns station, date, element, value """
+    df = pd.read_csv(filename, header=None, names=COLUMNS,
+                     usecols=["station", "date", "element", "value", "qflag"],
+                     dtype=DTYPES, engine="c")
+    keep = df["qflag"].isna()
+    if elements is not None:
+        keep &= df["element"].isin(elements)
+    df = df.loc[keep, ["station", "date", "element", "value"]]
+    for column in ("station", "element"):
+        df[column] = df[column].cat.remove_unused_categories()
+    return df.reset_index(drop=True)
+
+
+def _concat(frames):
+    """ Concatenates frames, keeping station and element categorical """
+    if not frames:
+        return pd.DataFrame({c: pd.Series(dtype=DTYPES[c])
+                             for c in ("station", "date", "element", "value")})
+    columns = {}
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([f[column] for f in frames])
+        else:
+            columns[column] = pd.concat([f[column] for f in frames],
+                                        ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def load(filenames, elements=ELEMENTS, workers=None):
+    """ Returns the rows of all filenames as one DataFrame, parsing the
+    files in parallel """
+    filenames = sorted(filenames)
+    workers = min(workers or os.cpu_count() or 1, len(filenames) or 1)
+    if workers == 1:
+        frames = [read_ghcn(f, elements) for f in filenames]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            frames = list(pool.map(read_ghcn, filenames,
+                                   [elements] * len(filenames)))
+    return _concat(frames)
+
+
+def _means(df, keys):
+    """ Returns the mean value in degrees C per keys and element, with one
+    column per element """
+    grouped = df.groupby(keys + [df["element"]], observed=True)["value"]
+    means = grouped.mean().div(10).unstack("element")
+    means.columns = list(means.columns)
+    return means
+
+
+def yearly_means(df):
+    """ Returns the mean TMAX and TMIN (degrees C) per station and year """
+    return _means(df, [df["station"], (df["date"] // 10000).rename("year")])
+
+
+def monthly_means(df):
+    """ Returns the mean TMAX and TMIN (degrees C) per station, year and
+    month """
+    return _means(df, [df["station"], (df["date"] // 10000).rename("year"),
+                       (df["date"] // 100 % 100).rename("month")])
+
+
+def partial_aggregates(filename, elements=ELEMENTS):
+    """ Returns sum, count, min and max of the values of one file per
+    station, element, year and month """
+    df = read_ghcn(filename, elements)
+    keys = [df["station"], df["element"], (df["date"] // 10000).rename("year"),
+            (df["date"] // 100 % 100).rename("month")]
+    grouped = df["value"].astype("int64").groupby(keys, observed=True)
+    return grouped.agg(["sum", "count", "min", "max"])
+
+
+def merge_partials(partials):
+    """ Returns the partial aggregates of several files combined """
+    if not partials:
+        return pd.DataFrame(columns=["sum", "count", "min", "max"])
+    combined = pd.concat(partials)
+    return combined.groupby(level=list(combined.index.names),
+                            observed=True).agg(
+        {"sum": "sum", "count": "sum", "min": "min", "max": "max"})
+
+
+def means_from_partials(partials, monthly=True):
+    """ Returns mean TMAX and TMIN (degrees C) per station, year and month,
+    or per station and year, from partial aggregates """
+    keys = ["station", "year", "month"] if monthly else ["station", "year"]
+    totals = partials.groupby(level=keys + ["element"], observed=True)[
+        ["sum", "count"]].sum()
+    means = (totals["sum"] / totals["count"] / 10).unstack("element")
+    means.columns = list(means.columns)
+    return means
+
+
+class AggregateCache:
+    """ Per-file partial aggregates stored in a pickle file, keyed by path
+    and recomputed when a file's size or modification time changes """
+
+    def __init__(self, filename=DEFAULT_CACHE, elements=ELEMENTS):
+        self.filename = filename
+        self.elements = tuple(elements)
+        self.entries = {}
+        self.parsed = 0
+        try:
+            with open(filename, 'rb') as f:
+                stored = pickle.load(f)
+            if (isinstance(stored, dict)
+                    and stored.get("elements") == self.elements
+                    and isinstance(stored.get("entries"), dict)):
+                self.entries = stored["entries"]
+        except Exception:
+            # missing, truncated or foreign: everything is parsed again
+            self.entries = {}
+
+    def save(self):
+        """ Writes the cache file, replacing it atomically """
+        tmp = self.filename + ".tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({"elements": self.elements, "entries": self.entries},
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.filename)
+
+    def partials(self, filenames, workers=None):
+        """ Returns the merged partial aggregates of filenames, parsing only
+        the files not in the cache or changed since; the entries of other
+        files are dropped """
+        keys = {}
+        stale = []
+        for filename in sorted(filenames):
+            path = os.path.abspath(filename)
+            st = os.stat(path)
+            keys[path] = (st.st_size, st.st_mtime_ns)
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != keys[path]:
+                stale.append(path)
+
+        workers = min(workers or os.cpu_count() or 1, len(stale) or 1)
+        if workers == 1:
+            fresh = [partial_aggregates(p, self.elements) for p in stale]
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                fresh = list(pool.map(partial_aggregates, stale,
+                                      [self.elements] * len(stale)))
+        dropped = len(self.entries.keys() - keys.keys())
+        entries = {p: self.entries[p] for p in keys if p in self.entries}
+        for path, partial in zip(stale, fresh):
+            entries[path] = (keys[path], partial)
+        self.entries = entries
+        self.parsed = len(stale)
+        if stale or dropped:
+            self.save()
+        return merge_partials([self.entries[p][1] for p in keys])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="GHCN-Daily CSV files (default: %s)" % DATA_GLOB)
+    parser.add_argument("-m", "--monthly", action="store_true",
+                        help="monthly instead of yearly means")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="parse every file, without the aggregate cache")
+    add_jobs_argument(parser)
+    args = parser.parse_args(argv[1:])
+    filenames = args.files or glob.glob(DATA_GLOB)
+    if not filenames:
+        parser.error("no files given and none match %s" % DATA_GLOB)
+    if args.cache:
+        cache = AggregateCache()
+        partials = cache.partials(filenames, args.jobs)
+        print("parsed %d of %d files" % (cache.parsed, len(filenames)),
+              file=sys.stderr)
+        means = means_from_partials(partials, args.monthly)
+    else:
+        df = load(filenames, workers=args.jobs)
+        means = monthly_means(df) if args.monthly else yearly_means(df)
+    print(means.round(2).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,261 @@
+"""Propose (and create) indexes for a workload of SQLite queries.
+
+The join queries of the Databases appendix, e.g.
+
+    SELECT A1.FinalID, A1.Consumer, A2.FinalID, A2.OriginalTraitName
+    FROM Consumer A1, TraitInfo A2 WHERE A1.FinalID = A2.FinalID
+
+run on the hand-built Biotraits.db as a full scan of one table and, for
+every row of it, a lookup in an index SQLite builds on the fly and throws
+away again (AUTOMATIC COVERING INDEX in the plan). This tool runs
+EXPLAIN QUERY PLAN on every query of a workload, picks out the SCAN and
+automatic-index steps, and for each such table proposes one covering
+index: the columns compared with constants, then the join columns, then
+the other columns the query reads from that table, so the query never
+has to visit the table rows. create_indexes() (--create) builds them (and
+runs ANALYZE); main() times the workload before and after.
+
+The SQL is read with regular expressions, which is enough for the
+comma-join and JOIN ... ON queries of the course, not for SQL in general.
+
+    python3 index_advisor.py [DB] [--create] [QUERY ...]
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+from collections import OrderedDict, namedtuple
+
+from runtools import best_time
+
+# The queries of the Databases appendix
+WORKLOAD = [
+    "SELECT A1.FinalID, A1.Consumer, A2.FinalID, A2.OriginalTraitName "
+    "FROM Consumer A1, TraitInfo A2 WHERE A1.FinalID = A2.FinalID",
+
+    "SELECT A1.ConTemp, A1.OriginalTraitValue, A2.OriginalTraitName, "
+    "A3.Consumer FROM TCP A1, TraitInfo A2, Consumer A3 "
+    "WHERE A1.FinalID = A2.FinalID AND A3.ConSpecies = 'Mytilus edulis' "
+    "AND A3.FinalID = A2.FinalID",
+
+    "SELECT DISTINCT Habitat FROM TraitInfo "
+    "WHERE OriginalTraitName = 'Resource Consumption Rate'",
+]
+
+Proposal = namedtuple("Proposal", "table columns sql queries")
+
+PLAN_STEP_RE = re.compile(
+    r"^(SCAN|SEARCH)(?: TABLE)? (\w+)(?: AS (\w+))?(.*)$")
+FROM_RE = re.compile(
+    r"\bFROM\s+(.+?)(?:\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|$)",
+    re.IGNORECASE | re.DOTALL)
+TABLE_REF_RE = re.compile(r"^\s*(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+JOIN_SPLIT_RE = re.compile(
+    r",|\b(?:NATURAL\s+)?(?:LEFT\s+(?:OUTER\s+)?|INNER\s+|CROSS\s+)?JOIN\b",
+    re.IGNORECASE)
+QUALIFIED_RE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+LITERAL = r"(?:'(?:[^']|'')*'|\"[^\"]*\"|-?\d+(?:\.\d*)?|\?)"
+CONST_EQ_RE = re.compile(
+    r"(?:\b([A-Za-z_]\w*)\.)?\b([A-Za-z_]\w*)\s*=\s*" + LITERAL
+    + r"|" + LITERAL + r"\s*=\s*(?:\b([A-Za-z_]\w*)\.)?\b([A-Za-z_]\w*)")
+JOIN_EQ_RE = re.compile(
+    r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)")
+KEYWORDS = {"ON", "WHERE", "GROUP", "ORDER", "LIMIT", "USING", "NATURAL",
+            "LEFT", "INNER", "CROSS", "JOIN", "OUTER"}
+
+
+def query_plan(conn, sql, params=()):
+    """ Returns the detail strings of EXPLAIN QUERY PLAN for sql """
+    return [row[-1] for row in
+            conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def slow_steps(plan):
+    """ Returns [(name, detail)] for the plan steps that scan a table or
+    build an automatic index; name is the alias or table name """
+    steps = []
+    for detail in plan:
+        m = PLAN_STEP_RE.match(detail)
+        if m is None:
+            continue
+        kind, name, alias, rest = m.groups()
+        if (kind == "SCAN" and "INDEX" not in rest) or "AUTOMATIC" in rest:
+            steps.append((alias or name, detail))
+    return steps
+
+
+def table_aliases(sql):
+    """ Returns {alias or table name: table} for the FROM clause of sql """
+    m = FROM_RE.search(sql)
+    if m is None:
+        return {}
+    aliases = {}
+    for part in JOIN_SPLIT_RE.split(m.group(1)):
+        part = re.split(r"\bON\b|\bUSING\b", part, flags=re.IGNORECASE)[0]
+        ref = TABLE_REF_RE.match(part)
+        if ref is None:
+            continue
+        table, alias = ref.groups()
+        aliases[table] = table
+        if alias and alias.upper() not in KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def table_columns(conn, table):
+    """ Returns (columns, rowid alias or None) of table """
+    columns = []
+    rowid = None
+    pk = [row for row in conn.execute("PRAGMA table_info(%s)" % table)]
+    for _, name, decl, _, _, is_pk in pk:
+        columns.append(name)
+        if is_pk and decl.upper() == "INTEGER" and \
+                sum(1 for row in pk if row[5]) == 1:
+            rowid = name
+    return columns, rowid
+
+
+def index_columns(conn, sql, name, aliases):
+    """ Returns the ordered columns of a covering index of the table known
+    as name in sql """
+    table = aliases.get(name, name)
+    columns, rowid = table_columns(conn, table)
+    by_lower = {c.lower(): c for c in columns}
+    single = len(set(aliases.values())) <= 1
+
+    def own(alias, column):
+        """ Returns the column's name if it belongs to this table """
+        if alias is None and not single:
+            return None
+        if alias is not None and alias != name:
+            return None
+        return by_lower.get(column.lower())
+
+    const, joined, read = [], [], []
+    for m in CONST_EQ_RE.finditer(sql):
+        alias, column = (m.group(1), m.group(2)) if m.group(2) \
+            else (m.group(3), m.group(4))
+        column = own(alias, column)
+        if column:
+            const.append(column)
+    for a1, c1, a2, c2 in JOIN_EQ_RE.findall(sql):
+        for alias, column in ((a1, c1), (a2, c2)):
+            column = own(alias, column)
+            if column:
+                joined.append(column)
+    if single:
+        words = {w.lower() for w in re.findall(r"\b\w+\b", sql)}
+        read = [c for c in columns if c.lower() in words]
+    else:
+        read = [own(alias, column) for alias, column in
+                QUALIFIED_RE.findall(sql)]
+    ordered = OrderedDict()
+    for column in const + joined + read:
+        if column and column != rowid:
+            ordered[column] = True
+    return list(ordered)
+
+
+def advise(conn, workload=WORKLOAD):
+    """ Returns the index Proposals for the slow steps of the workload """
+    proposals = OrderedDict()
+    for sql in workload:
+        aliases = table_aliases(sql)
+        for name, _ in slow_steps(query_plan(conn, sql)):
+            table = aliases.get(name, name)
+            columns = index_columns(conn, sql, name, aliases)
+            if not columns:
+                continue
+            key = (table, tuple(columns))
+            if key not in proposals:
+                index = "advisor_%s_%s" % (table, "_".join(columns))
+                proposals[key] = Proposal(
+                    table, columns, "CREATE INDEX IF NOT EXISTS %s ON %s (%s)"
+                    % (index, table, ", ".join(columns)), [])
+            proposals[key].queries.append(sql)
+    # an index whose columns start another one's on the same table is
+    # redundant
+    kept = []
+    for (table, columns), p in proposals.items():
+        if not any(t == table and len(c) > len(columns)
+                   and c[:len(columns)] == columns for t, c in proposals):
+            kept.append(p)
+    return kept
+
+
+def time_workload(conn, workload=WORKLOAD, repeat=5):
+    """ Returns [(sql, best seconds, rows)] running every query to the end """
+    timings = []
+    for sql in workload:
+        best, rows = best_time(lambda: conn.execute(sql).fetchall(),
+                               repeat=repeat)
+        timings.append((sql, best, len(rows)))
+    return timings
+
+
+def create_indexes(conn, proposals):
+    """ Creates the proposed indexes and updates the planner statistics """
+    with conn:
+        for p in proposals:
+            conn.execute(p.sql)
+    conn.execute("ANALYZE")
+
+
+def _short(sql, width=70):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= width else sql[:width - 3] + "..."
+
+
+def main(argv):
+    import biotraits_load
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db", nargs="?",
+                        help="database file (default: %s, built without "
+                             "indexes if missing)" % biotraits_load.DEFAULT_DB)
+    parser.add_argument("queries", nargs="*", metavar="QUERY",
+                        help="workload (default: the Databases appendix "
+                             "queries)")
+    parser.add_argument("--create", action="store_true",
+                        help="create the proposed indexes and time the "
+                             "workload again")
+    args = parser.parse_args(argv[1:])
+    db = args.db or biotraits_load.DEFAULT_DB
+    create = args.create
+    workload = args.queries or WORKLOAD
+    if args.db is None and not os.path.exists(db):
+        # the database as built by hand in the appendix: no indexes
+        tables = {t: (c, f, []) for t, (c, f, _)
+                  in biotraits_load.TABLES.items()}
+        biotraits_load.bulk_load(db, tables=tables)
+    conn = sqlite3.connect(db)
+    try:
+        before = time_workload(conn, workload)
+        for sql in workload:
+            print(_short(sql))
+            for step in query_plan(conn, sql):
+                print("    " + step)
+        proposals = advise(conn, workload)
+        print("\nProposed indexes:" if proposals else "\nNo index proposed")
+        for p in proposals:
+            print("    " + p.sql + ";")
+        if not create or not proposals:
+            return 0
+        create_indexes(conn, proposals)
+        after = time_workload(conn, workload)
+        print("\n%-70s %10s %10s %8s" % ("query", "before s", "after s",
+                                         "speed-up"))
+        for (sql, t0, n), (_, t1, _) in zip(before, after):
+            print("%-70s %10.5f %10.5f %7.1fx" % (_short(sql), t0, t1,
+                                                  t0 / t1))
+            for step in query_plan(conn, sql):
+                print("    " + step)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
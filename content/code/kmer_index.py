@@ -0,0 +1,209 @@
+"""k-mer seed index for proposing candidate offsets to align_seqs.py.
+
+Rather than scoring every start offset of the shorter sequence on the
+longer (reference) one, the reference's k-mers are indexed once as a sorted
+NumPy array of 2-bit codes (A=0, C=1, G=2, T=3, so k <= 31 fits a uint64)
+with their positions. Every k-mer the query shares with the reference
+votes for the diagonal (offset) ref_pos - query_pos; only the most voted
+offsets are then scored in full, together with every offset within
+DEFAULT_BAND of them, since repeats and indels spread the votes of one
+placement over neighbouring diagonals. When even the best diagonal has
+fewer than MIN_VOTES votes the seeds are no better than chance, and every
+offset is scored instead.
+
+The index can be saved to a .npy file and memory-mapped back, so repeated
+queries against the same reference skip rebuilding it:
+
+    index = KmerIndex.build(ref, k=11)
+    index.save("ref.k11.npy")
+    index = KmerIndex.load("ref.k11.npy")
+    offset, score, candidates = seeded_best_offset(ref, query, index)
+"""
+
+import sys
+
+import numpy as np
+
+import align_seqs
+from packed_seq import BASE_CODES
+
+DEFAULT_K = 11
+DEFAULT_TOP = 10
+
+# offsets within this distance of a top diagonal are scored as well
+DEFAULT_BAND = 16
+
+# below this many votes for the best diagonal, seeded_best_offset() scores
+# every offset
+MIN_VOTES = 10
+
+# k-mers occurring more often than this in the reference (e.g. poly-A) are
+# ignored as seeds
+MAX_OCCURRENCES = 1000
+
+# Record layout of a saved index; the first record holds (k, reference
+# length) rather than a k-mer
+INDEX_DTYPE = np.dtype([("code", "<u8"), ("pos", "<i8")])
+
+
+def kmer_codes(seq, k):
+    """ Returns (codes, positions) of the k-mers of seq that contain only
+    A, C, G and T, as rolling 2-bit codes """
+    if not 1 <= k <= 31:
+        raise ValueError("k must be between 1 and 31, not %d" % k)
+    c = BASE_CODES[align_seqs.encode(seq)]
+    n = len(c) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+
+    codes = np.zeros(n, dtype=np.uint64)
+    for t in range(k):
+        codes <<= np.uint64(2)
+        codes |= (c[t:t + n] & 3).astype(np.uint64)
+    # drop windows holding an N or other non-ACGT symbol
+    bad = np.concatenate(([0], np.cumsum(c == 255)))
+    keep = (bad[k:] - bad[:n]) == 0
+    return codes[keep], np.flatnonzero(keep)
+
+
+class KmerIndex:
+    """ Sorted k-mer codes of a reference sequence and their positions """
+
+    __slots__ = ("k", "length", "codes", "positions")
+
+    def __init__(self, k, length, codes, positions):
+        self.k = k
+        self.length = length
+        self.codes = codes
+        self.positions = positions
+
+    @classmethod
+    def build(cls, ref, k=DEFAULT_K):
+        """ Returns the index of the k-mers of ref """
+        codes, positions = kmer_codes(ref, k)
+        order = np.argsort(codes, kind="stable")
+        return cls(k, len(ref), codes[order], positions[order])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def save(self, filename):
+        """ Writes the index to a .npy file """
+        records = np.empty(len(self.codes) + 1, dtype=INDEX_DTYPE)
+        records[0] = (self.k, self.length)
+        records["code"][1:] = self.codes
+        records["pos"][1:] = self.positions
+        np.save(filename, records)
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r"):
+        """ Returns an index saved with save(), memory-mapped by default """
+        records = np.load(filename, mmap_mode=mmap_mode)
+        if records.dtype != INDEX_DTYPE:
+            raise ValueError("%s is not a k-mer index" % filename)
+        k, length = int(records["code"][0]), int(records["pos"][0])
+        return cls(k, length, records["code"][1:], records["pos"][1:])
+
+    def lookup(self, code):
+        """ Returns the reference positions of one k-mer code """
+        lo = np.searchsorted(self.codes, np.uint64(code), side="left")
+        hi = np.searchsorted(self.codes, np.uint64(code), side="right")
+        return self.positions[lo:hi]
+
+    def diagonal_votes(self, query, max_occurrences=MAX_OCCURRENCES):
+        """ Returns (offsets, votes): every offset 0 <= ref_pos - query_pos <
+        len(reference) supported by a shared k-mer, and its number of
+        shared k-mers """
+        q_codes, q_pos = kmer_codes(query, self.k)
+        lo = np.searchsorted(self.codes, q_codes, side="left")
+        hi = np.searchsorted(self.codes, q_codes, side="right")
+        counts = hi - lo
+        use = (counts > 0) & (counts <= max_occurrences)
+        lo, counts, q_pos = lo[use], counts[use], q_pos[use]
+        if len(lo) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # expand every [lo, hi) range of index rows without a Python loop
+        total = int(counts.sum())
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        rows = starts + np.arange(total)
+        diagonals = self.positions[rows] - np.repeat(q_pos, counts)
+        diagonals = diagonals[(diagonals >= 0) & (diagonals < self.length)]
+        return np.unique(diagonals, return_counts=True)
+
+    def candidate_offsets(self, query, top=DEFAULT_TOP):
+        """ Returns (offsets, votes) of the top most voted offsets of query,
+        best first """
+        offsets, votes = self.diagonal_votes(query)
+        order = np.lexsort((offsets, -votes))[:top] # ties: smaller offset
+        return offsets[order], votes[order]
+
+
+def candidate_windows(candidates, length, band=DEFAULT_BAND):
+    """ Returns the sorted, disjoint [lo, hi) offset ranges covering every
+    offset within band of a candidate and inside 0 .. length - 1
+
+    >>> candidate_windows(np.array([40, 5, 12]), 45, band=3)
+    [(2, 16), (37, 44)]
+    """
+    windows = []
+    for offset in sorted(int(c) for c in candidates):
+        lo, hi = max(0, offset - band), min(length, offset + band + 1)
+        if windows and lo <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], hi))
+        else:
+            windows.append((lo, hi))
+    return windows
+
+
+def seeded_best_offset(ref, query, index=None, k=DEFAULT_K, top=DEFAULT_TOP,
+                       band=DEFAULT_BAND, min_votes=MIN_VOTES):
+    """ Returns (offset, score, candidates) for the best placement of query
+    on ref among the offsets within band of the top seeded ones; falls back
+    to scoring every offset when the best seed has fewer than min_votes
+    votes """
+    if index is None:
+        index = KmerIndex.build(ref, k)
+    candidates, votes = index.candidate_offsets(query, top)
+    if len(candidates) == 0 or votes[0] < min_votes:
+        offset, score, _ = align_seqs.best_offset(ref, query)
+        return offset, score, candidates
+
+    # score every offset of a window at once on the slice of ref it reads
+    a1, a2 = align_seqs.encode(ref), align_seqs.encode(query)
+    best_offset, best_score = 0, -1
+    for lo, hi in candidate_windows(candidates, len(ref), band):
+        scores = align_seqs.score_all_offsets(a1[lo:hi + len(a2)], a2)
+        i = int(np.argmax(scores[:hi - lo]))
+        if scores[i] > best_score:
+            best_offset, best_score = lo + i, int(scores[i])
+    return best_offset, best_score, candidates
+
+
+def main(argv):
+    from fasta_reader import FastaFile
+    if len(argv) not in (3, 4):
+        print("usage: python3 kmer_index.py ref.fasta query.fasta [index.npy]")
+        return 1
+    with FastaFile(argv[1]) as fa, FastaFile(argv[2]) as fq:
+        ref = next(iter(fa)).seq()
+        query = next(iter(fq)).seq()
+        index = None
+        if len(argv) == 4:
+            try:
+                index = KmerIndex.load(argv[3])
+            except FileNotFoundError:
+                pass
+            # an index saved for another reference would give wrong votes
+            if index is None or index.length != len(ref):
+                index = KmerIndex.build(ref)
+                index.save(argv[3])
+        offset, score, candidates = seeded_best_offset(ref, query, index)
+    print("Candidate offsets:", candidates.tolist())
+    print("Best offset:", offset, "score:", score)
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,144 @@
+"""Regex search over memory-mapped files, in parallel.
+
+The regex workflows of the Python chapters read a whole file into a string
+and then run re.findall() over it. Here compiled *bytes* patterns run
+directly over an mmap of each file (re accepts any buffer and a pos/endpos
+window), so nothing is copied into Python strings except the matches.
+
+Big files are cut into chunks of about CHUNK_SIZE bytes, each ending just
+after a newline, and files and chunks are searched by a process pool. Each
+chunk reports the matches that start in it, searched for in the whole
+file: the search window runs OVERLAP bytes past the chunk, and a match
+reaching the end of that window (which $ or \Z could have matched there,
+or which may have been cut short) is searched for again without a window.
+A chunk starting inside a match of the chunk before is searched again
+from the end of that match, as one finditer() over the whole file would. The results
+are those of finditer() over the whole file unless a lookahead looks more
+than OVERLAP bytes past the end of a match.
+
+    for path, offset, text in grep(rb"Q[\\w\\s].*\\s", ["../data/TestOaksData.csv"]):
+        print(path, offset, text)
+
+    python3 mmap_grep.py [-j JOBS] PATTERN FILE [FILE ...]
+"""
+
+import argparse
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import patterns
+from runtools import add_jobs_argument, ordered_results
+
+CHUNK_SIZE = 2 ** 26
+
+# Bytes past the end of a chunk searched for the matches starting in it
+OVERLAP = 2 ** 16
+
+# Chunks kept in flight per worker
+TASKS_PER_WORKER = 4
+
+
+def chunk_bounds(path, chunk_size=CHUNK_SIZE):
+    """ Returns [(start, end)] byte ranges covering path, each ending just
+    after a newline (or at the end of the file) """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    bounds = []
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                newline = mm.find(b"\n", end - 1)
+                end = size if newline < 0 else newline + 1
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def scan_chunk(pattern, path, start, end):
+    """ Returns [(offset, match)] for the matches of pattern over the whole
+    of path that start in bytes start:end """
+    if end <= start:
+        return []
+    found = []
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        limit = min(size, end + OVERLAP)
+        # an empty match at the very end of the file belongs to the last
+        # chunk
+        stop = end + 1 if end == size else end
+        for m in pattern.finditer(mm, start, limit):
+            if m.start() >= stop:
+                break
+            if limit < size and m.end() >= limit - 1:
+                # $ may have matched at the window's end (or before its
+                # last newline), or the match been cut short there
+                for m in pattern.finditer(mm, m.start()):
+                    if m.start() >= stop:
+                        break
+                    found.append((m.start(), m.group()))
+                break
+            found.append((m.start(), m.group()))
+    return found
+
+
+def grep(pattern, paths, workers=None, chunk_size=CHUNK_SIZE):
+    """ Yields (path, offset, match) for a bytes pattern (str or compiled)
+    over every file in paths, in file and offset order """
+    pattern = patterns.compile(pattern)
+    if isinstance(pattern.pattern, str):
+        raise TypeError("mmap_grep needs a bytes pattern, e.g. rb'...'")
+    tasks = [(path, start, end) for path in paths
+             for start, end in chunk_bounds(path, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        results = (((pattern,) + task, scan_chunk(pattern, *task))
+                   for task in tasks)
+        yield from _merge_chunks(results)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        tasks = ((pattern,) + task for task in tasks)
+        yield from _merge_chunks(ordered_results(
+            pool, scan_chunk, tasks, workers * TASKS_PER_WORKER))
+
+
+def _merge_chunks(results):
+    """ Yields (path, offset, match) from the (task, matches) of consecutive
+    chunks. A chunk whose matches start inside a match of the chunk before
+    is searched again from the end of that match, in this process """
+    last_path = None
+    last_end = 0
+    for (pattern, path, start, end), found in results:
+        if path != last_path:
+            last_path, last_end = path, 0
+        if found and found[0][0] < last_end:
+            found = scan_chunk(pattern, path, last_end, end)
+        for offset, match in found:
+            last_end = offset + len(match)
+            yield path, offset, match
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pattern", help="regular expression (as bytes)")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    add_jobs_argument(parser)
+    args = parser.parse_args(argv[1:])
+    pattern = patterns.compile(args.pattern.encode())
+    out = sys.stdout.buffer
+    for path, offset, match in grep(pattern, args.files, args.jobs):
+        out.write(b"%s:%d:%s\n" % (path.encode(), offset,
+                                   match.rstrip(b"\r\n")))
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
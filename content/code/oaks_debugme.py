@@ -1,26 +1,66 @@
+import argparse
 import csv
 import sys
 
+# Rows written per writerows() call
+BATCH_SIZE = 10000
+
 #Define function
 def is_an_oak(name):
     """ Returns True if name is starts with 'quercus' """
     return name.lower().startswith('quercs')
 
-def main(argv): 
-    f = open('../data/TestOaksData.csv','r')
-    g = open('../data/JustOaksData.csv','w')
-    taxa = csv.reader(f)
-    csvwrite = csv.writer(g)
-    oaks = set()
-    for row in taxa:
-        print(row)
-        print ("The genus is: ") 
-        print(row[0] + '\n')
-        if is_an_oak(row[0]):
-            print('FOUND AN OAK!\n')
-            csvwrite.writerow([row[0], row[1]])    
+def genus_in(genera):
+    """ Returns a predicate that is True for names whose genus (first word,
+    any case) is one of genera; a set lookup, for filtering many genera """
+    genera = frozenset(g.lower() for g in genera)
+    def predicate(name):
+        words = name.split()
+        return bool(words) and words[0].lower() in genera
+    return predicate
+
+def filter_genera(rows, writer, keep=is_an_oak, batch_size=BATCH_SIZE,
+                  verbose=False):
+    """ Writes the (genus, species) of every row whose genus (first field)
+    passes keep to a csv writer, batch_size rows at a time; returns the
+    number of rows written """
+    batch = []
+    found = 0
+    for row in rows:
+        if not row:
+            continue
+        if verbose:
+            print(row)
+            print ("The genus is: ")
+            print(row[0] + '\n')
+        if keep(row[0]):
+            if verbose:
+                print('FOUND AN OAK!\n')
+            batch.append(row[:2])
+            if len(batch) >= batch_size:
+                writer.writerows(batch)
+                found += len(batch)
+                batch = []
+    writer.writerows(batch)
+    return found + len(batch)
 
+def main(argv):
+    parser = argparse.ArgumentParser(description="Find the oaks in a "
+                                                 "csv of genus, species rows")
+    parser.add_argument('infile', nargs='?',
+                        default='../data/TestOaksData.csv')
+    parser.add_argument('outfile', nargs='?',
+                        default='../data/JustOaksData.csv')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print every row as it is checked")
+    args = parser.parse_args(argv[1:])
+    with open(args.infile, 'r', newline='') as f, \
+            open(args.outfile, 'w', newline='') as g:
+        found = filter_genera(csv.reader(f), csv.writer(g),
+                              verbose=args.verbose)
+    print("Found %d oaks" % found)
     return 0
-    
+
 if (__name__ == "__main__"):
-    status = main(sys.argv)
\ No newline at end of file
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,274 @@
+"""Compact 2-bit-per-base DNA sequences.
+
+A PackedSeq stores A, C, G and T as 2-bit codes packed 32 to a uint64 word
+(base i sits in bits 2i, 2i + 1 of word i // 32), a quarter of the memory of
+a str or uint8 array. N and every other symbol are recorded as exception
+runs (start, end, symbol) and always score as mismatches.
+
+Matches between two packed sequences are counted a word at a time: the XOR
+of two words is zero in every 2-bit lane where the bases agree, so
+
+    matches = popcount(~(x | x >> 1) & valid lanes)
+
+covers 32 bases per operation. score_offsets() uses this to score every
+start offset, like align_seqs.score_all_offsets().
+
+    >>> s = PackedSeq.pack("ACGTNNAC")
+    >>> str(s.reverse_complement())
+    'GTNNACGT'
+    >>> str(s[2:6]), s.count_matches(PackedSeq.pack("GT"), 2)
+    ('GTNN', 2)
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+BASES = b"ACGT"
+BASES_PER_WORD = 32
+
+# 0b0101...01: the low bit of every 2-bit lane
+LOW_BITS = np.uint64(0x5555555555555555)
+
+# ASCII -> 2-bit code, 255 for symbols stored as exceptions
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    BASE_CODES[_base] = _code
+    BASE_CODES[ord(chr(_base).lower())] = _code
+
+# IUPAC complements for exception symbols
+COMPLEMENT = bytes.maketrans(b"ACGTRYKMSWBDHVNacgtrykmswbdhvn",
+                              b"TGCAYRMKSWVHDBNtgcayrmkswvhdbn")
+
+_LANE_SHIFTS = (2 * np.arange(BASES_PER_WORD)).astype(np.uint64)
+
+# Words packed or compared at a time, to bound temporary memory
+BLOCK_WORDS = 2 ** 18
+
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words):
+        """ Returns the number of set bits of each uint64 in words """
+        return np.bitwise_count(words)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)],
+                            dtype=np.uint8)
+
+    def _popcount(words):
+        """ Returns the number of set bits of each uint64 in words """
+        as_bytes = np.ascontiguousarray(words).view(np.uint8)
+        counts = _BYTE_COUNTS[as_bytes].reshape(words.shape + (8,))
+        return counts.sum(axis=-1, dtype=np.uint64)
+
+
+def _n_words(n):
+    return (n + BASES_PER_WORD - 1) // BASES_PER_WORD
+
+
+def _pack_codes(codes):
+    """ Returns uint64 words holding 2-bit codes (uint8 values 0-3) """
+    n = len(codes)
+    words = np.zeros(_n_words(n), dtype=np.uint64)
+    step = BLOCK_WORDS * BASES_PER_WORD
+    for start in range(0, n, step):
+        block = codes[start:start + step]
+        padded = np.zeros(_n_words(len(block)) * BASES_PER_WORD,
+                          dtype=np.uint64)
+        padded[:len(block)] = block
+        lanes = padded.reshape(-1, BASES_PER_WORD) << _LANE_SHIFTS
+        words[start // BASES_PER_WORD:(start + len(block) - 1)
+              // BASES_PER_WORD + 1] = np.bitwise_or.reduce(lanes, axis=1)
+    return words
+
+
+def _unpack_codes(words, n):
+    """ Returns the first n 2-bit codes of words as a uint8 array """
+    lanes = (words[:, None] >> _LANE_SHIFTS) & np.uint64(3)
+    return lanes.astype(np.uint8).reshape(-1)[:n]
+
+
+def _shift_words(words, bases):
+    """ Returns words moved down by bases lanes (base `bases` becomes base 0),
+    filling the top with zeros """
+    q, r = divmod(bases, BASES_PER_WORD)
+    words = words[q:]
+    if r == 0:
+        return words.copy()
+    s = np.uint64(2 * r)
+    out = words >> s
+    out[:-1] |= words[1:] << (np.uint64(64) - s)
+    return out
+
+
+def _clear_tail(words, n):
+    """ Zeroes the lanes at and beyond base n of words, in place """
+    r = n % BASES_PER_WORD
+    if r and len(words):
+        words[-1] &= np.uint64((1 << (2 * r)) - 1)
+    return words
+
+
+class PackedSeq:
+    """ A DNA sequence packed at 2 bits per base, with exception runs for
+    symbols other than A, C, G and T (lower-case bases are packed as upper
+    case) """
+
+    __slots__ = ("words", "length", "exc_starts", "exc_ends", "exc_symbols")
+
+    def __init__(self, words, length, exc_starts=None, exc_ends=None,
+                 exc_symbols=None):
+        self.words = words
+        self.length = length
+        empty = np.zeros(0, dtype=np.int64)
+        self.exc_starts = empty if exc_starts is None else exc_starts
+        self.exc_ends = empty if exc_ends is None else exc_ends
+        self.exc_symbols = (np.zeros(0, dtype=np.uint8) if exc_symbols is None
+                            else exc_symbols)
+
+    @classmethod
+    def pack(cls, seq):
+        """ Returns seq (str, bytes or uint8 array) as a PackedSeq """
+        if isinstance(seq, str):
+            seq = seq.encode('ascii')
+        a = np.frombuffer(seq, dtype=np.uint8) if isinstance(seq, bytes) \
+            else np.asarray(seq, dtype=np.uint8)
+        codes = BASE_CODES[a]
+        exceptional = codes == 255
+        idx = np.flatnonzero(exceptional)
+        if len(idx) == 0:
+            return cls(_pack_codes(codes), len(a))
+
+        codes[idx] = 0
+        # one run per stretch of consecutive positions with the same symbol
+        symbols = a[idx]
+        breaks = np.flatnonzero((np.diff(idx) != 1)
+                                | (np.diff(symbols) != 0)) + 1
+        firsts = np.concatenate(([0], breaks))
+        lasts = np.concatenate((breaks - 1, [len(idx) - 1]))
+        return cls(_pack_codes(codes), len(a), idx[firsts].astype(np.int64),
+                   idx[lasts].astype(np.int64) + 1, symbols[firsts].copy())
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """ Bytes used by the packed words and the exception runs """
+        return (self.words.nbytes + self.exc_starts.nbytes
+                + self.exc_ends.nbytes + self.exc_symbols.nbytes)
+
+    def unpack(self):
+        """ Returns the sequence as an ASCII uint8 array """
+        out = np.frombuffer(BASES, dtype=np.uint8)[
+            _unpack_codes(self.words, self.length)]
+        for start, end, symbol in zip(self.exc_starts, self.exc_ends,
+                                      self.exc_symbols):
+            out[start:end] = symbol
+        return out
+
+    def __str__(self):
+        return self.unpack().tobytes().decode('ascii')
+
+    def __repr__(self):
+        return "PackedSeq(length=%d)" % self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return PackedSeq.pack(self.unpack()[key])
+            n = max(0, stop - start)
+            words = _clear_tail(_shift_words(self.words, start)[:_n_words(n)],
+                                n)
+            starts = np.clip(self.exc_starts, start, start + n)
+            ends = np.clip(self.exc_ends, start, start + n)
+            keep = ends > starts
+            return PackedSeq(words, n, starts[keep] - start,
+                             ends[keep] - start, self.exc_symbols[keep])
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("PackedSeq index out of range")
+        run = np.flatnonzero((self.exc_starts <= key) & (key < self.exc_ends))
+        if len(run):
+            return chr(self.exc_symbols[run[0]])
+        word = int(self.words[key // BASES_PER_WORD])
+        return chr(BASES[(word >> (2 * (key % BASES_PER_WORD))) & 3])
+
+    def reverse_complement(self):
+        """ Returns the reverse complement as a new PackedSeq """
+        x = self.words ^ np.uint64(0xFFFFFFFFFFFFFFFF) # A<->T, C<->G
+        # reverse the 32 lanes of every word: swap lane pairs, then nibbles,
+        # then bytes
+        m2 = np.uint64(0x3333333333333333)
+        m4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+        x = ((x >> np.uint64(2)) & m2) | ((x & m2) << np.uint64(2))
+        x = ((x >> np.uint64(4)) & m4) | ((x & m4) << np.uint64(4))
+        x = x.byteswap()[::-1]
+        # the padding lanes of the last word are now at the bottom
+        pad = len(x) * BASES_PER_WORD - self.length
+        words = _clear_tail(_shift_words(x, pad)[:_n_words(self.length)],
+                            self.length)
+        symbols = np.frombuffer(
+            self.exc_symbols.tobytes().translate(COMPLEMENT), dtype=np.uint8)
+        return PackedSeq(words, self.length, (self.length - self.exc_ends)[::-1],
+                         (self.length - self.exc_starts)[::-1],
+                         symbols[::-1].copy())
+
+    def _valid_words(self):
+        """ Returns words with the low bit of every lane set for positions
+        holding a real base (not padding, not an exception) """
+        valid = np.full(len(self.words), LOW_BITS, dtype=np.uint64)
+        _clear_tail(valid, self.length)
+        if len(self.exc_starts):
+            mask = np.ones(self.length, dtype=np.uint8)
+            for start, end in zip(self.exc_starts, self.exc_ends):
+                mask[start:end] = 0
+            valid &= _pack_codes(mask)
+        return valid
+
+    def count_matches(self, other, offset=0):
+        """ Returns the number of matching bases when other is placed at
+        offset on self; overhanging positions and exceptions never match """
+        n = max(0, min(len(other), self.length - offset))
+        nw = _n_words(n)
+        a = _shift_words(self.words, offset)[:nw]
+        a_valid = _clear_tail(_shift_words(self._valid_words(), offset)[:nw], n)
+        x = a ^ other.words[:nw]
+        eq = ~(x | (x >> np.uint64(1))) & a_valid & other._valid_words()[:nw]
+        return int(_popcount(eq).sum())
+
+    def score_offsets(self, other, block_words=BLOCK_WORDS):
+        """ Returns an int64 array holding count_matches(other, offset) for
+        every offset 0 .. len(self) - 1 """
+        l1 = self.length
+        scores = np.zeros(l1, dtype=np.int64)
+        nw = len(other.words)
+        if l1 == 0 or nw == 0:
+            return scores
+        b = other.words
+        b_valid = other._valid_words()
+        # zero words past the end make every window full length; their
+        # lanes are not valid so overhanging positions never match
+        pad = np.zeros(nw, dtype=np.uint64)
+        words = np.concatenate((self.words, pad))
+        valid = np.concatenate((self._valid_words(), pad))
+        n_q = _n_words(l1)
+        rows = max(1, block_words // nw)
+        # offset 32q + r reads words q .. q + nw of the copy shifted by r
+        for r in range(min(BASES_PER_WORD, l1)):
+            a = sliding_window_view(_shift_words(words, r), nw)
+            a_valid = sliding_window_view(_shift_words(valid, r), nw)
+            q_max = min(n_q, (l1 - r + BASES_PER_WORD - 1) // BASES_PER_WORD)
+            for q in range(0, q_max, rows):
+                q_end = min(q + rows, q_max)
+                x = a[q:q_end] ^ b
+                eq = ~(x | (x >> np.uint64(1))) & a_valid[q:q_end] & b_valid
+                counts = _popcount(eq).sum(axis=1, dtype=np.int64)
+                scores[r + BASES_PER_WORD * q:r + BASES_PER_WORD * q_end:
+                       BASES_PER_WORD] = counts
+        return scores
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,209 @@
+"""Registry of compiled regular expressions, with usage statistics.
+
+re.search(pattern_string, ...) looks the pattern up in re's small internal
+cache and recompiles it whenever that cache has churned. Here named
+patterns used across the course scripts (emails, taxonomy records, GHCN
+temperature rows) are compiled once at import, any other pattern string
+goes through a bounded LRU cache with hit/miss counters, and every search
+made through the registry is timed per pattern, so hot regexes in batch
+jobs are visible. The timings of a cached pattern are dropped with it
+when it falls out of the cache:
+
+    import patterns
+    patterns.findall("email", text)            # a named pattern
+    patterns.search(r"Q[\\w\\s].*\\s", text)      # any pattern, cached
+    print(patterns.registry.report())
+"""
+
+import re
+import time
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 256
+
+# Named patterns precompiled in the default registry
+NAMED_PATTERNS = {
+    # re4.py: the simplest email pattern, and the full RFC-style one
+    "email_simple": (r'^[a-zA-Z0-9\._-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,4}$', 0),
+    "email": (r'[a-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-z0-9!\#$%&\'*+/=?^_`{|}~-]+)*'
+              r'@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+'
+              r'[a-z0-9](?:[a-z0-9-]*[a-z0-9])?', 0),
+    # a "Dr Firstname Lastname" in a scraped page (06-Python_II)
+    "doctor": (r'Dr\s+\w+\s+\w+', 0),
+    # a binomial species name
+    "binomial": (r'\b[A-Z][a-z]+ [a-z]+\b', 0),
+    # one Kingdom ... Phylum ... Species record of a taxonomy dump
+    "taxa": (rb"Kingdom\s+(\w+)"
+             rb"(?:(?!Kingdom).)*?Phylum\s+(\w+)"
+             rb"(?:(?!Kingdom).)*?Species\s+(\w+\s+\w+)", re.DOTALL),
+    # a GHCN-Daily CSV row: station, YYYYMMDD, element, value (tenths)
+    "ghcn": (rb"^(\w{11}),(\d{8}),(\w{4}),(-?\d+),", re.MULTILINE),
+}
+
+
+class PatternStats:
+    """ Number of calls and seconds spent in one pattern """
+
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+
+def _stats_key(compiled):
+    """ Identifies a compiled pattern by what it was compiled from """
+    return type(compiled.pattern), compiled.pattern, compiled.flags
+
+
+class PatternRegistry:
+    """ Named, precompiled patterns plus an LRU cache of compiled pattern
+    strings. The search functions accept a registered name, a pattern
+    string or a compiled pattern; compiled patterns that are not registered
+    take a slot in the LRU cache too, so their timings are bounded the
+    same way. """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.named = {}
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        # statistics by _stats_key(), for the named patterns and those in
+        # the cache; _refs counts the cache entries of each key
+        self._stats = {}
+        self._refs = {}
+        self._named_keys = {}
+
+    def register(self, name, pattern, flags=0):
+        """ Compiles pattern and stores it under name; returns it """
+        compiled = re.compile(pattern, flags)
+        self.named[name] = compiled
+        self._named_keys[_stats_key(compiled)] = name
+        return compiled
+
+    def compile(self, pattern, flags=0):
+        """ Returns the compiled pattern for a name, a pattern string (via the
+        LRU cache) or an already compiled pattern """
+        if isinstance(pattern, re.Pattern):
+            key = _stats_key(pattern)
+            if key not in self._named_keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                else:
+                    self._insert(key, pattern)
+            return pattern
+        if flags == 0 and pattern in self.named:
+            return self.named[pattern]
+        key = (type(pattern), pattern, flags)
+        compiled = self._cache.get(key)
+        if compiled is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return compiled
+        self.misses += 1
+        compiled = re.compile(pattern, flags)
+        self._insert(key, compiled)
+        return compiled
+
+    def _insert(self, key, compiled):
+        """ Caches compiled under key, evicting the least recently used
+        pattern, and its statistics, when the cache is full """
+        self._cache[key] = compiled
+        key = _stats_key(compiled)
+        self._refs[key] = self._refs.get(key, 0) + 1
+        if len(self._cache) > self.maxsize:
+            _, evicted = self._cache.popitem(last=False)
+            key = _stats_key(evicted)
+            self._refs[key] -= 1
+            if self._refs[key] == 0:
+                del self._refs[key]
+                if key not in self._named_keys:
+                    self._stats.pop(key, None)
+
+    def _timed(self, method, pattern, flags, *args):
+        compiled = self.compile(pattern, flags)
+        start = time.perf_counter()
+        try:
+            return getattr(compiled, method)(*args)
+        finally:
+            self._record(compiled, time.perf_counter() - start)
+
+    def _record(self, compiled, seconds):
+        key = _stats_key(compiled)
+        stats = self._stats.get(key)
+        if stats is None:
+            if key not in self._named_keys and key not in self._refs:
+                # evicted while it was running (a long finditer())
+                return
+            stats = self._stats[key] = PatternStats()
+        stats.calls += 1
+        stats.seconds += seconds
+
+    def search(self, pattern, string, flags=0):
+        return self._timed("search", pattern, flags, string)
+
+    def match(self, pattern, string, flags=0):
+        return self._timed("match", pattern, flags, string)
+
+    def fullmatch(self, pattern, string, flags=0):
+        return self._timed("fullmatch", pattern, flags, string)
+
+    def findall(self, pattern, string, flags=0):
+        return self._timed("findall", pattern, flags, string)
+
+    def sub(self, pattern, repl, string, count=0, flags=0):
+        return self._timed("sub", pattern, flags, repl, string, count)
+
+    def finditer(self, pattern, string, flags=0):
+        """ Yields the matches of pattern; the time spent finding them (not
+        the caller's time between matches) is recorded """
+        compiled = self.compile(pattern, flags)
+        matches = compiled.finditer(string)
+        seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                m = next(matches, None)
+                seconds += time.perf_counter() - start
+                if m is None:
+                    break
+                yield m
+        finally:
+            self._record(compiled, seconds)
+
+    def stats(self):
+        """ Returns {pattern string: (calls, seconds)}, slowest first """
+        rows = sorted(self._stats.items(), key=lambda kv: -kv[1].seconds)
+        return OrderedDict((self._named_keys.get(key, key[1]),
+                            (s.calls, s.seconds)) for key, s in rows)
+
+    def report(self):
+        """ Returns the cache counters and per-pattern timings as text """
+        lines = ["cache: %d hits, %d misses, %d of %d slots used"
+                 % (self.hits, self.misses, len(self._cache), self.maxsize)]
+        for label, (calls, seconds) in self.stats().items():
+            lines.append("%10.6f s %8d calls  %r" % (seconds, calls, label))
+        return "\n".join(lines)
+
+
+registry = PatternRegistry()
+for _name, (_pattern, _flags) in NAMED_PATTERNS.items():
+    registry.register(_name, _pattern, _flags)
+
+compile = registry.compile
+search = registry.search
+match = registry.match
+fullmatch = registry.fullmatch
+findall = registry.findall
+finditer = registry.finditer
+sub = registry.sub
+
+
+if __name__ == "__main__":
+    print(search("email", "very.common@example.com").group())
+    with open("../data/Temperatures/1800.csv", 'rb') as f:
+        print(len(findall("ghcn", f.read())), "GHCN records")
+    with open("../data/TestOaksData.csv") as f:
+        print(findall(r"Q[\w\s].*\s", f.read()))
+    print(registry.report())
@@ -0,0 +1,47 @@
+"""Helpers shared by the benchmark and batch scripts of the code directory.
+
+    seconds, result = best_time(func, arg, repeat=5)
+
+    parser = argparse.ArgumentParser()
+    add_jobs_argument(parser)             # -j/--jobs JOBS
+    with ProcessPoolExecutor(args.jobs) as pool:
+        for task, result in ordered_results(pool, work, tasks, 16):
+            ...
+"""
+
+import time
+from collections import deque
+
+
+def best_time(func, *args, repeat=3):
+    """ Returns (seconds, result) for the fastest of repeat calls of func """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def ordered_results(pool, func, tasks, max_pending):
+    """ Submits func(*task) to pool for every task, keeping at most
+    max_pending of them in flight, and yields (task, result) in task order;
+    results are streamed without queueing every task up front """
+    pending = deque()
+    for task in tasks:
+        pending.append((task, pool.submit(func, *task)))
+        if len(pending) >= max_pending:
+            task, future = pending.popleft()
+            yield task, future.result()
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
+
+
+def add_jobs_argument(parser):
+    """ Adds the -j/--jobs option (worker processes, default all cores) to
+    an argparse parser """
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: all cores)")
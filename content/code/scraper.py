@@ -0,0 +1,361 @@
+"""Concurrent web scraping with pooled connections and an on-disk cache.
+
+The scraping example of the Python II chapter opens a urllib3.PoolManager,
+reads one whole page into memory, decodes it and runs re.findall() on it.
+Here many URLs are fetched by a bounded thread pool sharing one
+PoolManager (so connections to the same host are reused), each response
+is decoded incrementally as it streams in, and compiled patterns are run
+over the decoded text chunk by chunk. An extractor may also be a function
+returning the (start, end) spans it finds in a text, such as
+email_extract.iter_emails, which scans scraped HTML in linear time where
+the email regex of re4.py can take quadratic time.
+
+Responses that carry an ETag or Last-Modified header are saved in a cache
+directory; later requests for the same URL are made conditional
+(If-None-Match / If-Modified-Since) and a 304 answer is served from the
+saved copy.
+
+serve_directory() runs a local http.server over a directory of saved
+pages, so the scraper can be tried without touching the network:
+
+    with serve_directory("../data") as base:
+        scraper = Scraper({"doctor": "doctor",
+                           "email": email_extract.iter_emails},
+                          cache_dir="scrape_cache")
+        for url, status, found in scraper.scrape([base + "/page.html"]):
+            print(url, status, found["doctor"])
+
+    python3 scraper.py [URL ...]
+    python3 scraper.py --test      # run the doctests
+"""
+
+import codecs
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+import email_extract
+import patterns
+
+CHUNK_SIZE = 2 ** 16
+DEFAULT_WORKERS = 8
+
+# A match ending less than this many characters before the end of the text
+# seen so far may still grow, so it waits for the next chunk
+DEFAULT_MARGIN = 256
+
+CHARSET_RE = re.compile(r"charset=([\w.:-]+)", re.IGNORECASE)
+
+
+class IncrementalExtractor:
+    """ Runs a compiled pattern, or a function yielding (start, end) spans,
+    over text fed in chunks, returning the same matches as one pass over
+    the whole text for extractors that look at most margin characters
+    past the end of a match """
+
+    def __init__(self, pattern, margin=DEFAULT_MARGIN):
+        self.pattern = pattern
+        self.margin = margin
+        self.carry = ""
+
+    def _matches(self, text):
+        """ Yields (start, end, found) for the matches in text """
+        if isinstance(self.pattern, re.Pattern):
+            for m in patterns.finditer(self.pattern, text):
+                yield m.start(), m.end(), m.groups() or m.group()
+        else:
+            for start, end in self.pattern(text):
+                yield start, end, text[start:end]
+
+    def feed(self, text, final=False):
+        """ Returns the groups (or whole matches) completed by text """
+        buf = self.carry + text
+        limit = len(buf) if final else len(buf) - self.margin
+        found = []
+        keep = max(0, limit)
+        for start, end, match in self._matches(buf):
+            if end > limit:
+                keep = start
+                break
+            found.append(match)
+            keep = max(keep, end)
+        self.carry = buf[keep:]
+        return found
+
+
+class HTTPCache:
+    """ Response bodies with their ETag/Last-Modified validators, one pair
+    of files per URL in a directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory,
+                            hashlib.sha1(url.encode()).hexdigest())
+
+    def validators(self, url):
+        """ Returns the saved {header: value} for url, {} if there is none """
+        try:
+            with open(self._path(url) + ".json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def conditional_headers(self, url):
+        """ Returns the request headers making a fetch of url conditional """
+        saved = self.validators(url)
+        headers = {}
+        if "etag" in saved:
+            headers["If-None-Match"] = saved["etag"]
+        if "last-modified" in saved:
+            headers["If-Modified-Since"] = saved["last-modified"]
+        return headers
+
+    def open_body(self, url):
+        return open(self._path(url) + ".body", 'rb')
+
+    def writer(self, url, response):
+        """ Returns a file to save the body of response in, or None when the
+        response has no validators; commit() must be called when done """
+        saved = {"etag": response.headers.get("ETag"),
+                 "last-modified": response.headers.get("Last-Modified"),
+                 "content-type": response.headers.get("Content-Type")}
+        saved = {k: v for k, v in saved.items() if v}
+        if "etag" not in saved and "last-modified" not in saved:
+            return None
+        return _CacheWriter(self.directory, self._path(url), saved)
+
+
+def _write_replace(directory, path, data):
+    """ Writes data to a new temporary file in directory and moves it to
+    path """
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class _CacheWriter:
+    """ Writes a body to its own temporary file and moves it into place,
+    with its validators, once complete; concurrent fetches of one URL each
+    write their own copy and the last one to finish wins """
+
+    def __init__(self, directory, path, saved):
+        self.directory = directory
+        self.path = path
+        self.saved = saved
+        fd, self.tmp = tempfile.mkstemp(dir=directory)
+        self.f = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.f.write(data)
+
+    def commit(self):
+        self.f.close()
+        os.replace(self.tmp, self.path + ".body")
+        _write_replace(self.directory, self.path + ".json",
+                       json.dumps(self.saved))
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.tmp)
+
+
+def _charset(content_type, default="utf-8"):
+    m = CHARSET_RE.search(content_type or "")
+    if m:
+        try:
+            codecs.lookup(m.group(1))
+            return m.group(1)
+        except LookupError:
+            pass
+    return default
+
+
+class Scraper:
+    """ Fetches URLs concurrently over one PoolManager and applies named
+    extractors (patterns, or span functions such as
+    email_extract.iter_emails) to the decoded bodies as they stream in """
+
+    def __init__(self, extractors, cache_dir=None, workers=DEFAULT_WORKERS,
+                 chunk_size=CHUNK_SIZE, margin=DEFAULT_MARGIN, **pool_kw):
+        self.extractors = {name: p if callable(p) else patterns.compile(p)
+                           for name, p in extractors.items()}
+        self.cache = HTTPCache(cache_dir) if cache_dir else None
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.margin = margin
+        pool_kw.setdefault("maxsize", workers)
+        self.http = urllib3.PoolManager(**pool_kw)
+
+    def _extract(self, chunks, charset):
+        """ Returns {name: matches} for the byte chunks decoded with
+        charset """
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        running = {name: IncrementalExtractor(p, self.margin)
+                   for name, p in self.extractors.items()}
+        found = {name: [] for name in running}
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            for name, ex in running.items():
+                found[name].extend(ex.feed(text))
+        text = decoder.decode(b"", final=True)
+        for name, ex in running.items():
+            found[name].extend(ex.feed(text, final=True))
+        return found
+
+    def fetch(self, url):
+        """ Returns (status, {name: matches}) for one URL; status 304 means
+        the cached copy was used """
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+        r = self.http.request("GET", url, headers=headers,
+                              preload_content=False)
+        try:
+            if r.status == 304 and self.cache:
+                content_type = self.cache.validators(url).get("content-type")
+                with self.cache.open_body(url) as f:
+                    chunks = iter(functools.partial(f.read, self.chunk_size),
+                                  b"")
+                    return r.status, self._extract(chunks,
+                                                   _charset(content_type))
+            writer = None
+            if self.cache and r.status == 200:
+                writer = self.cache.writer(url, r)
+            chunks = r.stream(self.chunk_size)
+            if writer:
+                chunks = _tee(chunks, writer)
+            try:
+                found = self._extract(chunks,
+                                      _charset(r.headers.get("Content-Type")))
+            except BaseException:
+                if writer:
+                    writer.abort()
+                raise
+            if writer:
+                writer.commit()
+            return r.status, found
+        finally:
+            r.release_conn()
+
+    def scrape(self, urls):
+        """ Yields (url, status, {name: matches}) for every URL, in the
+        order the fetches complete; a failed fetch gives status None and
+        the exception in place of the matches """
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = {pool.submit(self.fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    status, found = future.result()
+                except (urllib3.exceptions.HTTPError, OSError) as e:
+                    yield url, None, e
+                else:
+                    yield url, status, found
+
+
+def _tee(chunks, writer):
+    for chunk in chunks:
+        writer.write(chunk)
+        yield chunk
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(directory, port=0):
+    """ Serves directory over HTTP on localhost in a background thread;
+    yields the base URL. Files get Last-Modified headers and
+    If-Modified-Since requests are answered with 304, so a second fetch
+    through a cache finds the same matches in the saved copy:
+
+    >>> directory = tempfile.mkdtemp()
+    >>> with open(os.path.join(directory, "page.html"), "w") as f:
+    ...     _ = f.write("<p>ask Dr Ann Smith: "
+    ...                 "<a href='mailto:ann@example.org'>"
+    ...                 "ann@example.org</a></p>")
+    >>> scraper = Scraper({"doctor": "doctor",
+    ...                    "email": email_extract.iter_emails},
+    ...                   cache_dir=os.path.join(directory, "cache"))
+    >>> with serve_directory(directory) as base:
+    ...     first = scraper.fetch(base + "/page.html")
+    ...     second = scraper.fetch(base + "/page.html")
+    >>> first[0], first[1]["doctor"]
+    (200, ['Dr Ann Smith'])
+    >>> first[1]["email"]
+    ['ann@example.org', 'ann@example.org']
+    >>> second == (304, first[1])
+    True
+
+    Concurrent fetches of one URL each cache their own copy (the later ones
+    may already be answered from the cache):
+
+    >>> with serve_directory(directory) as base:
+    ...     scraper = Scraper({"email": email_extract.iter_emails},
+    ...                       cache_dir=os.path.join(directory, "cache2"))
+    ...     results = list(scraper.scrape([base + "/page.html"] * 8))
+    >>> sorted({status for _, status, _ in results} - {200, 304})
+    []
+    >>> [found["email"] for _, _, found in results] == [first[1]["email"]] * 8
+    True
+    >>> import shutil; shutil.rmtree(directory)
+    """
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:%d" % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main(argv):
+    from urllib.parse import quote
+    if argv[1:] == ["--test"]:
+        import doctest
+        return doctest.testmod().failed
+    extractors = {"doctor": "doctor", "email": email_extract.iter_emails}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scraper = Scraper(extractors, cache_dir=cache_dir)
+        if len(argv) > 1:
+            for url, status, found in scraper.scrape(argv[1:]):
+                print(url, status, found)
+            return 0
+        # no URLs: scrape the saved pages of ../data through a local server,
+        # twice, the second time from the cache
+        data = "../data"
+        pages = [name for name in sorted(os.listdir(data))
+                 if name.endswith((".html", ".txt"))]
+        with serve_directory(data) as base:
+            urls = [base + "/" + quote(name) for name in pages]
+            for attempt in ("first", "second"):
+                print("%s pass:" % attempt)
+                for url, status, found in sorted(scraper.scrape(urls)):
+                    print("  %3s %-50s %s" % (
+                        status, url[len(base) + 1:][:50],
+                        ", ".join("%d %s" % (len(v), k)
+                                  for k, v in found.items())))
+    print(patterns.registry.report())
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,255 @@
+"""Fetch SQLite query results straight into typed NumPy columns.
+
+c.fetchall() followed by pd.DataFrame(rows) keeps a tuple per row and a
+Python int, float or str object per cell alive at the same time as the
+frame being built from them. fetch_columns() instead reads the result in
+fetchmany() chunks and copies every chunk into one NumPy buffer per
+column, typed from the column's declared type by SQLite's affinity rules
+(INTEGER -> int64, REAL -> float64, TEXT -> object, ...), as in the
+communities table of buildmcdb.sql:
+
+    IDcommunity INTEGER PRIMARY KEY, IDsite INTEGER, year REAL,
+    IDspecies TEXT, presence INTEGER, abundance REAL, mass REAL
+
+Only one chunk of rows exists as Python objects at a time, and a text
+column keeps one str object per distinct value. Buffers grow by doubling
+(or are sized once from expected_rows) and are trimmed at the end.
+
+SQLite does not enforce declared types, so a column is widened when its
+values do not fit: integers with a NULL or a real become float64 (NULL as
+NaN), and numbers mixed with text become an object column. Columns of
+expressions, which have no declared type, and all the columns of queries
+with parameters (which cannot be probed for their declared types) are
+typed from their first chunk of values.
+
+    cols = fetch_columns(conn, "SELECT * FROM communities")
+    df = fetch_frame(conn, "SELECT year, mass FROM communities "
+                           "WHERE IDsite = ?", (3,))
+
+    python3 sqlite_columns.py [ROWS]
+"""
+
+import sqlite3
+import sys
+
+import numpy as np
+
+FETCH_CHUNK = 10000
+INITIAL_CAPACITY = 1024
+
+_PROBE_VIEW = "_sqlite_columns_probe"
+
+
+def affinity_dtype(decl):
+    """ Returns the NumPy dtype for a declared column type, following
+    SQLite's affinity rules; None for no declared type (or BLOB) """
+    decl = (decl or "").upper()
+    if "INT" in decl:
+        return np.dtype(np.int64)
+    if "CHAR" in decl or "CLOB" in decl or "TEXT" in decl:
+        return np.dtype(object)
+    if not decl or "BLOB" in decl:
+        return None
+    # REAL, FLOAT, DOUBLE and NUMERIC
+    return np.dtype(np.float64)
+
+
+def declared_types(conn, sql):
+    """ Returns the declared type of every result column of sql ('' for
+    expressions), or None if sql cannot be put in a view (e.g. it has
+    parameters) """
+    try:
+        conn.execute("CREATE TEMP VIEW %s AS %s" % (_PROBE_VIEW, sql))
+    except sqlite3.Error:
+        return None
+    try:
+        return [row[2] for row in
+                conn.execute("PRAGMA temp.table_info(%s)" % _PROBE_VIEW)]
+    finally:
+        conn.execute("DROP VIEW temp.%s" % _PROBE_VIEW)
+
+
+class _Column:
+    """ A growing typed buffer for one result column """
+
+    __slots__ = ("dtype", "values", "nulls", "strings")
+
+    def __init__(self, dtype, capacity):
+        self.dtype = dtype
+        self.values = None if dtype is None else np.empty(capacity, dtype)
+        self.nulls = None
+        # one object per distinct string of a text column
+        self.strings = {}
+
+    def _retype(self, dtype, n):
+        """ Converts the first n values to dtype """
+        values = np.empty(len(self.values), dtype)
+        if dtype == object and self.nulls is not None:
+            values[:n] = self.values[:n].astype(object)
+            values[:n][self.nulls[:n]] = None
+            self.nulls = None
+        else:
+            values[:n] = self.values[:n]
+        self.values = values
+        self.dtype = np.dtype(dtype)
+
+    def _grow(self, capacity):
+        values = np.empty(capacity, self.dtype)
+        values[:len(self.values)] = self.values
+        self.values = values
+        if self.nulls is not None:
+            nulls = np.zeros(capacity, dtype=bool)
+            nulls[:len(self.nulls)] = self.nulls
+            self.nulls = nulls
+
+    def _mark_nulls(self, start, mask):
+        if self.nulls is None:
+            self.nulls = np.zeros(len(self.values), dtype=bool)
+        self.nulls[start:start + len(mask)] = mask
+
+    def put(self, n, chunk, capacity):
+        """ Stores the values of chunk (a sequence) at n .. n + len(chunk) """
+        if self.values is None:
+            # no declared type: take the type of the first non-NULL values
+            present = [v for v in chunk if v is not None]
+            kind = np.asarray(present).dtype.kind if present else "f"
+            dtype = np.int64 if kind in "iub" else \
+                np.float64 if kind == "f" else object
+            self.dtype = np.dtype(dtype)
+            self.values = np.empty(capacity, dtype)
+        elif len(self.values) < capacity:
+            self._grow(capacity)
+        k = len(chunk)
+        if self.dtype == object:
+            strings = self.strings
+            block = np.empty(k, dtype=object)
+            block[:] = [strings.setdefault(v, v) if type(v) is str else v
+                        for v in chunk]
+            self.values[n:n + k] = block
+            return
+
+        block = np.asarray(chunk)
+        if block.dtype.kind == "O":
+            # NULLs, or numbers mixed with text or blobs
+            mask = np.fromiter((v is None for v in chunk), bool, k)
+            present = [v for v in chunk if v is not None]
+            kind = np.asarray(present).dtype.kind if present else "i"
+            if kind in "iubf":
+                self._mark_nulls(n, mask)
+                block = np.zeros(k, np.float64 if kind == "f" else np.int64)
+                block[~mask] = present
+        elif self.nulls is not None:
+            self.nulls[n:n + k] = False
+        if block.dtype.kind not in "iubf":
+            self._retype(object, n)
+            return self.put(n, chunk, capacity)
+        if block.dtype.kind == "f" and self.dtype.kind == "i":
+            self._retype(np.float64, n)
+        self.values[n:n + k] = block
+
+    def result(self, n):
+        """ Returns the first n values; integers with NULLs as float64 with
+        NaN, floats with NULLs as NaN """
+        if self.values is None:
+            return np.empty(0, dtype=object)
+        values = self.values[:n].copy()
+        if self.nulls is not None and self.nulls[:n].any():
+            values = values.astype(np.float64)
+            values[self.nulls[:n]] = np.nan
+        return values
+
+
+def fetch_columns(conn, sql, params=(), dtypes=None, chunk_size=FETCH_CHUNK,
+                  expected_rows=None):
+    """ Returns {column name: NumPy array} for the result of sql; dtypes
+    maps column names to dtypes that override the declared types """
+    decls = declared_types(conn, sql) if not params else None
+    cursor = conn.execute(sql, params)
+    try:
+        names = [d[0] for d in cursor.description]
+        if decls is None or len(decls) != len(names):
+            decls = [""] * len(names)
+        dtypes = dtypes or {}
+        capacity = max(expected_rows or INITIAL_CAPACITY, 1)
+        columns = [_Column(np.dtype(dtypes[name]) if name in dtypes
+                           else affinity_dtype(decl), capacity)
+                   for name, decl in zip(names, decls)]
+        n = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            k = len(rows)
+            while n + k > capacity:
+                capacity *= 2
+            # one C-level transpose of the chunk into per-column tuples
+            for column, chunk in zip(columns, zip(*rows)):
+                column.put(n, chunk, capacity)
+            n += k
+            del rows
+    finally:
+        cursor.close()
+    return {name: column.result(n) for name, column in zip(names, columns)}
+
+
+def fetch_frame(conn, sql, params=(), **kw):
+    """ Returns the result of sql as a pandas DataFrame built from the
+    columns of fetch_columns() without copying them """
+    import pandas as pd
+    return pd.DataFrame(fetch_columns(conn, sql, params, **kw), copy=False)
+
+
+def _communities(n_rows):
+    """ Returns an in-memory database holding n_rows random communities
+    rows, with the schema of buildmcdb.sql """
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE communities (
+        IDcommunity INTEGER PRIMARY KEY,
+        IDsite INTEGER,
+        year REAL,
+        IDspecies TEXT,
+        presence INTEGER,
+        abundance REAL,
+        mass REAL)""")
+    rng = np.random.default_rng(0)
+    species = ["SP%04d" % i for i in range(500)]
+    rows = zip(range(n_rows), rng.integers(0, 300, n_rows).tolist(),
+               rng.integers(1950, 2010, n_rows).astype(float).tolist(),
+               [species[i] for i in rng.integers(0, 500, n_rows)],
+               rng.integers(0, 2, n_rows).tolist(),
+               rng.random(n_rows).tolist(),
+               (rng.random(n_rows) * 100).tolist())
+    with conn:
+        conn.executemany("INSERT INTO communities VALUES (?,?,?,?,?,?,?)",
+                         rows)
+    return conn
+
+
+def main(argv):
+    import time
+    import tracemalloc
+    import pandas as pd
+    n_rows = int(argv[1]) if len(argv) > 1 else 500000
+    conn = _communities(n_rows)
+    sql = "SELECT * FROM communities"
+    names = [d[0] for d in conn.execute(sql + " LIMIT 0").description]
+
+    def via_fetchall():
+        return pd.DataFrame(conn.execute(sql).fetchall(), columns=names)
+
+    for label, func in (("fetchall + DataFrame", via_fetchall),
+                        ("fetch_frame", lambda: fetch_frame(conn, sql))):
+        tracemalloc.start()
+        start = time.perf_counter()
+        df = func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-22s %7.3f s  peak %7.1f MB" % (label, elapsed, peak / 2**20))
+    print(df.dtypes.to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
@@ -0,0 +1,352 @@
+"""A thread-safe pool of SQLite connections.
+
+pythonsql.py and sqlitemem.py open one connection and run every statement
+through it. A sqlite3 connection may not be shared between threads, and
+one connection serialises all queries anyway. SQLitePool instead gives
+every reading thread its own read-only connection, opened once and reused
+until the thread exits, with a large statement cache so the same query
+strings are compiled once per thread. Writes go through a bounded queue to a single writer thread,
+which owns the only read-write connection and commits each run of queued
+statements in one transaction; callers get a Future. Every query's
+latency is counted per SQL string.
+
+A writable pool switches the file to WAL mode, so that readers are not
+blocked by the writer. The journal mode is stored in the database file;
+close() restores the previous one, unless another connection still has
+the file open, in which case the file stays in WAL mode.
+
+When the pool is opened without writes, the readers open the file as
+immutable (mode=ro&immutable=1): SQLite then takes no locks at all, which
+is only safe if nothing else changes the file while the pool is open.
+
+    with SQLitePool("../data/wood.db") as pool:
+        rows = pool.query("SELECT Binomial FROM woodb WHERE Family = ?",
+                          ("Fagaceae",))
+    print(pool.report())
+
+    python3 sqlite_pool.py [DB] [THREADS]
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import quote
+
+CACHED_STATEMENTS = 512
+WRITE_QUEUE_SIZE = 1000
+
+# Statements the writer runs at most in one transaction
+WRITE_BATCH = 500
+
+_STOP = object()
+
+
+class QueryStats:
+    """ Calls, total and longest latency of one SQL string """
+
+    __slots__ = ("calls", "seconds", "longest")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+
+
+class _ReaderHolder:
+    """ The read-only connection of one thread, held in the pool's
+    threading.local so that it is finalized when the thread exits """
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _close_reader(readers, lock, conn):
+    with lock:
+        readers.discard(conn)
+    conn.close()
+
+
+class SQLitePool:
+    """ Per-thread read-only connections and one queued writer over an
+    SQLite database file """
+
+    def __init__(self, path, writable=False,
+                 cached_statements=CACHED_STATEMENTS,
+                 write_queue_size=WRITE_QUEUE_SIZE, timeout=5.0):
+        self.path = os.path.abspath(path)
+        self.writable = writable
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        self._local = threading.local()
+        self._readers = set()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._closed = False
+        # set once the writer has stopped: the exception its queued writes
+        # fail with
+        self._write_error = None
+        self._writes = None
+        self._writer = None
+        if writable:
+            self._writes = queue.Queue(write_queue_size)
+            self._writer = threading.Thread(target=self._write_loop,
+                                            name="sqlite-pool-writer",
+                                            daemon=True)
+            self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _uri(self, mode):
+        uri = "file:%s?mode=%s" % (quote(self.path), mode)
+        if mode == "ro" and not self.writable:
+            uri += "&immutable=1"
+        return uri
+
+    def _connect(self, mode):
+        return sqlite3.connect(self._uri(mode), uri=True,
+                               timeout=self.timeout,
+                               cached_statements=self.cached_statements,
+                               check_same_thread=False)
+
+    def _reader(self):
+        """ Returns the calling thread's read-only connection """
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("the pool is closed")
+            holder = self._local.holder = _ReaderHolder(self._connect("ro"))
+            with self._lock:
+                self._readers.add(holder.conn)
+            # the thread's locals are dropped when it exits, and with them
+            # its connection
+            weakref.finalize(holder, _close_reader, self._readers,
+                             self._lock, holder.conn)
+        return holder.conn
+
+    def _record(self, sql, seconds):
+        with self._lock:
+            stats = self._stats.get(sql)
+            if stats is None:
+                stats = self._stats[sql] = QueryStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            if seconds > stats.longest:
+                stats.longest = seconds
+
+    def query(self, sql, params=()):
+        """ Returns all the rows of a read query """
+        start = time.perf_counter()
+        try:
+            return self._reader().execute(sql, params).fetchall()
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def query_one(self, sql, params=()):
+        """ Returns the first row of a read query, or None """
+        start = time.perf_counter()
+        try:
+            return self._reader().execute(sql, params).fetchone()
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def execute(self, sql, params=()):
+        """ Queues a write; returns a Future of its cursor's rowcount.
+        Blocks while the write queue is full """
+        return self._submit(sql, params, False)
+
+    def executemany(self, sql, seq_of_params):
+        """ Queues a write run once per parameter tuple; returns a Future of
+        the total rowcount """
+        return self._submit(sql, list(seq_of_params), True)
+
+    def _submit(self, sql, params, many):
+        if not self.writable:
+            raise sqlite3.ProgrammingError("the pool was opened read-only")
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("the pool is closed")
+            if self._write_error is not None:
+                raise sqlite3.ProgrammingError(
+                    "the pool's writer has stopped") from self._write_error
+        future = Future()
+        self._writes.put((sql, params, many, future))
+        if self._write_error is not None:
+            # the writer stopped while this write was being queued
+            self._fail_pending(self._write_error)
+        return future
+
+    def _fail_pending(self, error):
+        """ Fails the Futures of every write left in the queue """
+        while True:
+            try:
+                item = self._writes.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[3].set_running_or_notify_cancel():
+                item[3].set_exception(error)
+
+    def _write_loop(self):
+        try:
+            conn = self._connect("rw")
+            try:
+                conn.isolation_level = None
+                (journal_mode,) = conn.execute(
+                    "PRAGMA journal_mode").fetchone()
+                conn.execute("PRAGMA journal_mode=WAL")
+                try:
+                    self._write_batches(conn)
+                finally:
+                    self._restore_journal_mode(conn, journal_mode)
+            finally:
+                conn.close()
+            error = sqlite3.ProgrammingError("the pool is closed")
+        except Exception as e:
+            error = e
+        # writes queued behind _STOP, or left when the writer failed, are
+        # never run
+        self._write_error = error
+        self._fail_pending(error)
+
+    def _restore_journal_mode(self, conn, journal_mode):
+        """ Switches the file back from WAL to journal_mode, which needs
+        every other connection to it closed """
+        if journal_mode.lower() == "wal":
+            return
+        try:
+            conn.execute("PRAGMA journal_mode=%s" % journal_mode)
+        except sqlite3.OperationalError:
+            pass # still open elsewhere: the file stays in WAL mode
+
+    def _write_batches(self, conn):
+        """ Runs the queued writes until _STOP """
+        while True:
+            item = self._writes.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < WRITE_BATCH:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(conn, batch)
+            if stop:
+                return
+
+    def _run_batch(self, conn, batch):
+        """ Runs queued writes in one transaction; a failing statement only
+        fails its own Future """
+        done = []
+        try:
+            conn.execute("BEGIN")
+            for sql, params, many, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                start = time.perf_counter()
+                try:
+                    conn.execute("SAVEPOINT pool_write")
+                    if many:
+                        cursor = conn.executemany(sql, params)
+                    else:
+                        cursor = conn.execute(sql, params)
+                    conn.execute("RELEASE pool_write")
+                    done.append((future, cursor.rowcount))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO pool_write")
+                    conn.execute("RELEASE pool_write")
+                    future.set_exception(e)
+                finally:
+                    self._record(sql, time.perf_counter() - start)
+            try:
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                for future, _ in done:
+                    future.set_exception(e)
+                return
+        except Exception as e:
+            # the connection itself failed: no write of the batch is kept
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        for future, rowcount in done:
+            future.set_result(rowcount)
+
+    def stats(self):
+        """ Returns {sql: (calls, total seconds, mean, longest)}, most total
+        time first """
+        with self._lock:
+            rows = sorted(self._stats.items(), key=lambda kv: -kv[1].seconds)
+            return OrderedDict((sql, (s.calls, s.seconds, s.seconds / s.calls,
+                                      s.longest)) for sql, s in rows)
+
+    def report(self):
+        """ Returns the latency counters as text """
+        lines = ["%8s %10s %10s %10s  %s" % ("calls", "total s", "mean ms",
+                                             "max ms", "query")]
+        for sql, (calls, seconds, mean, longest) in self.stats().items():
+            lines.append("%8d %10.4f %10.3f %10.3f  %s"
+                         % (calls, seconds, mean * 1e3, longest * 1e3,
+                            " ".join(sql.split())[:60]))
+        return "\n".join(lines)
+
+    def close(self):
+        """ Finishes the queued writes and closes every connection """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # the readers go first, so that the writer can leave WAL mode
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        if self._writer is not None:
+            self._writes.put(_STOP)
+            self._writer.join()
+
+
+def main(argv):
+    from concurrent.futures import ThreadPoolExecutor
+    db = argv[1] if len(argv) > 1 else "../data/wood.db"
+    threads = int(argv[2]) if len(argv) > 2 else 8
+    with SQLitePool(db) as pool:
+        families = [f for (f,) in pool.query(
+            "SELECT DISTINCT Family FROM woodb")]
+
+        def work(family):
+            return pool.query("SELECT Binomial, WoodDensity FROM woodb "
+                              "WHERE Family = ?", (family,))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as ex:
+            n = sum(len(rows) for rows in ex.map(work, families * 10))
+        elapsed = time.perf_counter() - start
+    print("%d queries, %d rows, %d threads: %.3f s"
+          % (len(families) * 10, n, threads, elapsed))
+    print(pool.report())
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
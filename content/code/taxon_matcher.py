@@ -0,0 +1,222 @@
+"""Find thousands of taxon names in a text in one pass (Aho-Corasick).
+
+Searching for each species name with its own re.findall() costs one pass
+over the text per name. A TaxonMatcher compiles all the names into one
+Aho-Corasick automaton (a trie of the names whose missing transitions are
+filled in from the failure links) and walks it once over the text, so the
+cost is one dictionary lookup per character whatever the number of names.
+
+Names match case-insensitively, as whole words, and any run of whitespace
+in the text (tabs, newlines, several spaces, as in blackbirds.txt) matches
+a single space in a name. Overlapping names are all reported, e.g. both
+"Turdus" and "Turdus merula" in "Turdus merula".
+
+    >>> m = TaxonMatcher(["Turdus merula", "Turdus", "Euphagus carolinus"])
+    >>> m.findall("A turdus\\tMerula and EUPHAGUS  carolinus; Turdusx")
+    [('Turdus', 2), ('Turdus merula', 2), ('Euphagus carolinus', 20)]
+
+Building the automaton is the slow part: matcher() keeps the recently built
+ones in memory and load_or_build() pickles one to a file for later runs.
+The text may be fed in chunks (scan()), so files of any size can be
+searched; iter_file_hits() does this for taxonomy dumps, cleaned as in
+taxonomy_stream.py.
+
+    python3 taxon_matcher.py [NAMES.txt] [TEXT_FILE]
+"""
+
+import functools
+import pickle
+import sys
+from collections import deque
+
+import taxonomy_stream
+
+WHITESPACE = frozenset(" \t\n\r\x0b\x0c")
+
+
+def normalize(name):
+    """ Returns name in lower case with whitespace runs made single spaces """
+    return " ".join(name.lower().split())
+
+
+def _lower(text):
+    """ Returns text in lower case, character for character """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # a few characters (e.g. U+0130) lowercase to two; leave those alone
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class TaxonMatcher:
+    """ An Aho-Corasick automaton over a list of taxon names """
+
+    def __init__(self, taxa):
+        self.taxa = tuple(taxa)
+        keys = [normalize(t) for t in self.taxa]
+        self.max_len = max((len(k) for k in keys), default=0)
+
+        # the trie: goto[state] maps a character to the next state
+        goto = [{}]
+        out = [[]]
+        for i, key in enumerate(keys):
+            if not key:
+                continue
+            state = 0
+            for c in key:
+                nxt = goto[state].get(c)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    out.append([])
+                    goto[state][c] = nxt
+                state = nxt
+            out[state].append(i)
+
+        # breadth-first: failure links, inherited outputs, and transitions of
+        # the failure state copied in (except those the root already has)
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque()
+        for state in goto[0].values():
+            delta[state] = dict(goto[state])
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for c, nxt in goto[state].items():
+                f = delta[fail[state]].get(c)
+                if f is None and fail[state] != 0:
+                    f = delta[0].get(c)
+                fail[nxt] = f or 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                inherited = dict(delta[fail[nxt]]) if fail[nxt] else {}
+                inherited.update(goto[nxt])
+                delta[nxt] = inherited
+                queue.append(nxt)
+        self.delta = delta
+        self.out = [tuple((i, len(keys[i])) for i in o) for o in out]
+
+    def __len__(self):
+        return len(self.taxa)
+
+    def scan(self, chunks):
+        """ Yields (taxon, offset) for every name found in the text made of
+        the str chunks, offsets counting from the start of the first """
+        delta = self.delta
+        root = delta[0]
+        out = self.out
+        taxa = self.taxa
+        state = 0
+        # (position, previous character is alphanumeric) of the last max_len
+        # characters that advanced the automaton
+        starts = deque(maxlen=max(1, self.max_len))
+        pending = []   # matches waiting for the character after their end
+        prev_alnum = False
+        prev_space = False
+        pos = 0
+        for chunk in chunks:
+            for c, raw in zip(_lower(chunk), chunk):
+                alnum = raw.isalnum()
+                if pending:
+                    if not alnum:
+                        yield from sorted(pending, key=lambda h: h[1])
+                    pending = []
+                if c in WHITESPACE:
+                    if prev_space:
+                        pos += 1
+                        prev_alnum = False
+                        continue
+                    c = " "
+                    prev_space = True
+                else:
+                    prev_space = False
+                starts.append((pos, prev_alnum))
+                nxt = delta[state].get(c)
+                state = root.get(c, 0) if nxt is None else nxt
+                for i, n in out[state]:
+                    start, before = starts[-n]
+                    if not before:
+                        pending.append((taxa[i], start))
+                prev_alnum = alnum
+                pos += 1
+        yield from sorted(pending, key=lambda h: h[1])
+
+    def finditer(self, text):
+        """ Yields (taxon, offset) for every name found in text """
+        return self.scan([text])
+
+    def findall(self, text):
+        """ Returns [(taxon, offset)] for every name found in text """
+        return list(self.scan([text]))
+
+    def save(self, filename):
+        """ Pickles the automaton to filename """
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename):
+        """ Returns a matcher saved with save() """
+        with open(filename, 'rb') as f:
+            matcher = pickle.load(f)
+        if not isinstance(matcher, TaxonMatcher):
+            raise ValueError("%s does not hold a TaxonMatcher" % filename)
+        return matcher
+
+
+@functools.lru_cache(maxsize=16)
+def _cached(taxa):
+    return TaxonMatcher(taxa)
+
+
+def matcher(taxa):
+    """ Returns the matcher of taxa, reusing one built by an earlier call
+    with the same names """
+    return _cached(tuple(taxa))
+
+
+def load_or_build(taxa, filename):
+    """ Returns the matcher pickled in filename if it was built for the same
+    names, otherwise builds it and pickles it there """
+    taxa = tuple(taxa)
+    try:
+        m = TaxonMatcher.load(filename)
+        if m.taxa == taxa:
+            return m
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    m = matcher(taxa)
+    m.save(filename)
+    return m
+
+
+def iter_file_hits(filename, taxon_matcher,
+                   chunk_size=taxonomy_stream.CHUNK_SIZE):
+    """ Yields (taxon, offset) for the names found in a taxonomy dump, read
+    in chunks and cleaned as by taxonomy_stream (so offsets count
+    characters of the cleaned, ASCII-only text) """
+    def chunks():
+        with open(filename, 'rb') as f:
+            for chunk in iter(functools.partial(f.read, chunk_size), b""):
+                yield taxonomy_stream.clean(chunk).decode('ascii')
+    return taxon_matcher.scan(chunks())
+
+
+def main(argv):
+    text_file = argv[2] if len(argv) > 2 else "../data/blackbirds.txt"
+    if len(argv) > 1:
+        with open(argv[1]) as f:
+            taxa = [line.strip() for line in f if line.strip()]
+    else:
+        # the species of the dump itself, and their genera
+        species = [s for _, _, s in taxonomy_stream.extract_taxa(text_file)]
+        taxa = sorted(set(species) | {s.split()[0] for s in species})
+    m = matcher(taxa)
+    for taxon, offset in iter_file_hits(text_file, m):
+        print("%8d  %s" % (offset, taxon))
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)
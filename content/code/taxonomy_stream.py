@@ -0,0 +1,90 @@
+"""Streaming (Kingdom, Phylum, Species) extractor for taxonomy dumps.
+
+blackbirds.py reads the whole of ../data/blackbirds.txt, replaces tabs and
+newlines in two full copies of the text and round-trips it through ASCII
+before any regex runs. Here the file is read in fixed-size binary chunks
+and each chunk is cleaned in a single bytes.translate() call (tabs, CRs and
+newlines become spaces, every non-ASCII byte is dropped, which is exactly
+what encoding the decoded text to ASCII with 'ignore' does). One compiled
+regex then picks the three ranks out of each record.
+
+A record runs from one "Kingdom" to the next, so everything before the last
+"Kingdom" seen holds only complete records; the rest is carried over to the
+next chunk. Text before the first "Kingdom" belongs to no record and is
+dropped as it is read. Memory use is one chunk plus the longest record,
+whatever the file size.
+
+    python3 taxonomy_stream.py [../data/blackbirds.txt]
+"""
+
+import re
+import sys
+
+import patterns
+
+CHUNK_SIZE = 2 ** 16
+
+# whitespace -> space, and the bytes to delete (all non-ASCII bytes)
+CLEAN_TABLE = bytes.maketrans(b"\t\r\n\x0b\x0c", b"     ")
+NON_ASCII = bytes(range(128, 256))
+
+RECORD_START = b"Kingdom"
+
+# one record: the rank values may not run on into the next record
+TAXON_RE = patterns.compile("taxa")
+SPACES_RE = re.compile(rb"\s+")
+
+
+def clean(chunk):
+    """ Returns chunk (bytes) with whitespace made spaces and non-ASCII
+    bytes removed """
+    return chunk.translate(CLEAN_TABLE, NON_ASCII)
+
+
+def _records(text):
+    """ Yields (kingdom, phylum, species) str tuples found in text """
+    for m in patterns.finditer(TAXON_RE, text):
+        yield tuple(SPACES_RE.sub(b" ", g).decode('ascii')
+                    for g in m.groups())
+
+
+def iter_taxa(f, chunk_size=CHUNK_SIZE):
+    """ Yields (kingdom, phylum, species) for every record of a binary file
+    object, reading it chunk_size bytes at a time """
+    # carry either starts with RECORD_START or holds none of it
+    carry = bytearray()
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        # only the new bytes, and a RECORD_START split across the chunk
+        # boundary, need searching
+        new = max(0, len(carry) - len(RECORD_START) + 1)
+        carry += clean(chunk)
+        last = carry.rfind(RECORD_START, new)
+        if last > 0:
+            yield from _records(bytes(carry[:last]))
+            del carry[:last]
+        elif last < 0 and not carry.startswith(RECORD_START):
+            # no record has started: keep what may begin a RECORD_START
+            del carry[:-(len(RECORD_START) - 1)]
+    yield from _records(bytes(carry))
+
+
+def extract_taxa(filename, chunk_size=CHUNK_SIZE):
+    """ Yields (kingdom, phylum, species) for every record of filename """
+    with open(filename, 'rb') as f:
+        yield from iter_taxa(f, chunk_size)
+
+
+def main(argv):
+    filename = argv[1] if len(argv) > 1 else "../data/blackbirds.txt"
+    for kingdom, phylum, species in extract_taxa(filename):
+        print("Kingdom: %-10s Phylum: %-10s Species: %s"
+              % (kingdom, phylum, species))
+    return 0
+
+
+if __name__ == "__main__":
+    status = main(sys.argv)
+    sys.exit(status)